@@ -3,17 +3,153 @@ by Craig Silverstein for Khan Academy's i18n effort.
 
 See here for reference:  http://crowdin.net/page/api
 """
+import collections
 import cStringIO
 import json
+import mmap
+import multiprocessing.pool
+import os
 import requests
+import threading
+import time
 import zipfile
 
-import secrets
+
+def _get_file_size(contents):
+    """Returns the size of a string or a seekable file-like object, or None
+    for a stream which can only be read once, like format.TranscriptStream.
+    """
+    if isinstance(contents, basestring):
+        return len(contents)
+    if not (hasattr(contents, 'seek') and hasattr(contents, 'tell')):
+        return None
+
+    position = contents.tell()
+    contents.seek(0, os.SEEK_END)
+    size = contents.tell() - position
+    contents.seek(position)
+    return size
+
+
+class LazyTranslations(collections.MutableMapping):
+    """A dict like {language: pot_format_translated_content}, which only
+    reads and decodes a file from the zip when its language is looked up.
+    """
+
+    def __init__(self, members):
+        """
+        Arguments:
+            members - a dict like {language: (zipfile.ZipFile, ZipInfo)}
+        """
+        # Values are a member until they are replaced by __setitem__
+        self.contents = dict(members)
+
+    def __getitem__(self, language):
+        content = self.contents[language]
+        if isinstance(content, tuple):
+            # Not kept, so memory does not grow as translations are read
+            zip_file, zip_info = content
+            return zip_file.read(zip_info).decode('utf-8')
+        return content
+
+    def __setitem__(self, language, content):
+        self.contents[language] = content
+
+    def __delitem__(self, language):
+        del self.contents[language]
+
+    def __iter__(self):
+        return iter(self.contents)
+
+    def __len__(self):
+        return len(self.contents)
+
+
+class _MappedFile(object):
+    """Wraps an mmap for zipfile, which calls read() with no size."""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.mapped) - self.mapped.tell()
+        return self.mapped.read(size)
+
+    def __getattr__(self, name):
+        return getattr(self.mapped, name)
+
 
 class CrowdInZipFile(object):
 
-    def __init__(self, zip_file):
-        self.zip_file = zipfile.ZipFile(cStringIO.StringIO(zip_file))
+    def __init__(self, zip_file, language=None):
+        """
+        Arguments:
+            zip_file - the contents of the zip as a string, or a file-like
+                object or mmap to read it from.  Members are only read when
+                they are looked up.
+            language - for the zip of a single language, like
+                download_translations('fr').  Otherwise the language of each
+                file is its top-level directory, as in 'all'.
+        """
+        if isinstance(zip_file, basestring):
+            zip_file = cStringIO.StringIO(zip_file)
+        elif isinstance(zip_file, mmap.mmap):
+            zip_file = _MappedFile(zip_file)
+
+        self.zip_file = zipfile.ZipFile(zip_file)
+        self.language = language
+        self._build_index()
+
+    @classmethod
+    def from_path(cls, path, use_mmap=False, language=None):
+        """Opens a zip file on disk, like one written by
+        CrowdInClient.download_translations(dest=path).
+
+        Arguments:
+            use_mmap - read the zip through an mmap instead of file reads.
+                The mapped pages are shared with the OS file cache, but
+                count towards this process's RSS once they are read.
+            language - see __init__()
+        """
+        with open(path, 'rb') as zip_file:
+            if use_mmap:
+                # The map keeps its own handle on the file
+                return cls(mmap.mmap(zip_file.fileno(), 0,
+                    access=mmap.ACCESS_READ), language)
+
+        return cls(open(path, 'rb'), language)
+
+    def close(self):
+        """Closes the zip, and the file or mmap it was read from."""
+        source = self.zip_file.fp
+        self.zip_file.close()
+        if source:
+            source.close()
+
+    def _build_index(self):
+        """Maps each file path to the zip members of its translations, like
+        {file_path: {language: (zipfile.ZipFile, ZipInfo)}}, so lookups do
+        not scan every member of the zip.
+        """
+        self.translations_by_path = {}
+
+        for zip_info in self.zip_file.infolist():
+            if zip_info.filename.endswith('/'):  # a directory
+                continue
+
+            if self.language:
+                locale = self.language
+                path = zip_info.filename
+                if path.startswith(locale + '/'):
+                    path = path[len(locale) + 1:]
+            else:
+                locale, _, path = zip_info.filename.partition('/')
+                if not path:  # not inside a language directory
+                    continue
+
+            self.translations_by_path.setdefault(path, {})[locale] = (
+                self.zip_file, zip_info)
 
     @staticmethod
     def get_po_path(title, video_id):
@@ -26,32 +162,231 @@ class CrowdInZipFile(object):
     def get_all_translations(self, file_path):
         """Finds all translations of a specific file_path.
 
-        Returns a dict like: {
+        Returns a LazyTranslations, a dict like: {
             language: pot_format_translated_content,
         }
         """
-        found_translations = {}
+        return LazyTranslations(self.translations_by_path.get(file_path, {}))
 
-        for filename in self.zip_file.namelist():
-            if filename.endswith('/'):  # a directory
-                continue
 
-            locale = filename.split('/', 1)[0]
-            path = filename.split('/', 1)[1]
+class MergedCrowdInZipFile(CrowdInZipFile):
+    """Looks up translations in several CrowdInZipFiles as if they were one,
+    like the per-language zips from CrowdInClient.download_languages().
+    """
+
+    def __init__(self, zip_files):
+        self.zip_files = list(zip_files)
+        self.translations_by_path = {}
+
+        for zip_file in self.zip_files:
+            for path, members in zip_file.translations_by_path.iteritems():
+                self.translations_by_path.setdefault(path, {}).update(members)
+
+    @classmethod
+    def from_paths(cls, paths_by_language, use_mmap=False):
+        """
+        Arguments:
+            paths_by_language - a dict like {language: zip_path}
+        """
+        return cls(CrowdInZipFile.from_path(path, use_mmap, language)
+            for language, path in paths_by_language.iteritems())
+
+    def get_file_count(self):
+        return sum(z.get_file_count() for z in self.zip_files)
+
+    def close(self):
+        for zip_file in self.zip_files:
+            zip_file.close()
 
-            if path == file_path:
-                found_translations[locale] = self.zip_file.read(filename).decode('utf-8')
 
-        return found_translations
+class ExportCache(object):
+    """Keeps the last translations export downloaded for each project and
+    package on disk, with the project's last_build at the time, so an
+    unchanged export does not have to be downloaded again.
+
+    Each export is stored as <identifier>-<package>.zip in cache_dir, next
+    to a .json file holding its last_build.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _get_paths(self, identifier, package):
+        base_path = os.path.join(self.cache_dir,
+            '%s-%s' % (identifier, package))
+        return base_path + '.zip', base_path + '.json'
+
+    def get_last_build(self, identifier, package='all'):
+        """Returns the last_build of the cached export, or None."""
+        zip_path, metadata_path = self._get_paths(identifier, package)
+        if not (os.path.isfile(zip_path) and os.path.isfile(metadata_path)):
+            return None
+
+        with open(metadata_path, 'r') as metadata_file:
+            return json.load(metadata_file).get('last_build')
+
+    def get(self, identifier, last_build, package='all'):
+        """Returns the path of the cached export, if it was downloaded when
+        the project's last_build was last_build, or None.
+        """
+        if self.get_last_build(identifier, package) != last_build:
+            return None
+        return self._get_paths(identifier, package)[0]
+
+    def get_download_path(self, identifier, package='all'):
+        """Returns a path to download a new export into, before set()."""
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        return self._get_paths(identifier, package)[0] + '.download'
+
+    def set(self, identifier, last_build, download_path, package='all'):
+        """Replaces the cached export with the file at download_path.
+
+        Returns:
+            The path of the cached export.
+        """
+        zip_path, metadata_path = self._get_paths(identifier, package)
+
+        # Removed first, so a failure cannot pair the old last_build with the
+        # new zip
+        if os.path.isfile(metadata_path):
+            os.remove(metadata_path)
+        os.rename(download_path, zip_path)
+
+        with open(metadata_path, 'w') as metadata_file:
+            json.dump({'last_build': last_build}, metadata_file)
+
+        return zip_path
+
+
+class ProjectTree(object):
+    """The files and directories in a CrowdIn project, in the format of
+    CrowdInClient.get_files_and_dirs(), and the project's last_activity
+    when they were listed.
+
+    Attributes:
+        files - a set like set(['dir/subdir/video.pot'])
+        dirs - a set like set(['dir/', 'dir/subdir/'])
+        last_activity - from get_project_info()['details']
+    """
+
+    def __init__(self, files, dirs, last_activity):
+        self.files = files
+        self.dirs = dirs
+        self.last_activity = last_activity
+
+    @staticmethod
+    def get_dir_path(name):
+        """Returns a directory name like 'dir/subdir/'."""
+        return name.strip('/') + '/'
+
+    def add_file(self, path):
+        self.files.add(path)
+
+    def add_directory(self, name):
+        self.dirs.add(self.get_dir_path(name))
+
+
+class TokenBucket(object):
+    """Limits how often something may happen: up to capacity times at once,
+    then rate times per second.  Safe to share between threads.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity,
+                    self.tokens + max(0, now - self.updated) * self.rate)
+                self.updated = max(now, self.updated)
+
+                if now >= self.updated and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = max(self.updated - now, (1 - self.tokens) / self.rate)
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Gives out no tokens for seconds, then refills from empty, so
+        requests resume at the steady rate rather than all at once.
+        """
+        with self.lock:
+            self.tokens = 0
+            self.updated = max(self.updated, time.time() + seconds)
 
 
 class CrowdInClient(object):
 
     EXPORT_SUCCESS_CODES = ('built', 'success')
 
-    def __init__(self, identifier, key):
+    # Bytes read from the network at a time when streaming a download
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+    # Connections kept open to CrowdIn, shared by concurrent requests
+    CONNECTION_POOL_SIZE = 8
+
+    # Defaults for add_files() and update_files()
+    UPLOAD_BATCH_SIZE = 10
+    UPLOAD_BATCH_BYTES = 8 * 1024 * 1024
+    UPLOAD_WORKERS = 4
+
+    # (requests per second, burst) allowed for each API action, every
+    # action not listed shares the 'default' limit.  Requests wait for their
+    # turn instead of failing, so work can be queued from many threads, for
+    # example with AsyncCrowdInClient, and runs as fast as allowed.
+    RATE_LIMITS = {
+        'default': (10, 20),
+        'add-file': (2, 4),
+        'update-file': (2, 4),
+        'download': (1, 4),
+    }
+
+    # Responses which mean CrowdIn is overloaded, the request is retried
+    # after the Retry-After header, or else BACKOFF_SECONDS doubled with
+    # each attempt
+    RETRY_STATUS_CODES = (429, 503)
+    MAX_RETRIES = 5
+    BACKOFF_SECONDS = 2
+
+    # build_export_zip() can only be called once in this many seconds
+    EXPORT_INTERVAL = 30 * 60
+
+    def __init__(self, identifier, key, export_times_path=None):
+        """
+        Arguments:
+            export_times_path - a JSON file in which to remember the last
+                time each project was exported, so the EXPORT_INTERVAL is
+                also honored between runs
+        """
         self.identifier = identifier
         self.key = key
+        self.export_times_path = export_times_path
+
+        self.rate_limits = dict((action, TokenBucket(rate, burst))
+            for action, (rate, burst) in self.RATE_LIMITS.iteritems())
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.CONNECTION_POOL_SIZE,
+            pool_maxsize=self.CONNECTION_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # A ProjectTree, see get_project_tree()
+        self.project_tree = None
+
+        # Loaded from export_times_path, see get_next_export_time()
+        self.last_export_time = None
 
     def _build_api_url(self, action):
         """Generate a URL needed for making a request to the translation API."""
@@ -64,6 +399,59 @@ class CrowdInClient(object):
             'action': action
         })
 
+    def _get_rate_limit(self, action):
+        # 'download/fr.zip' is limited as 'download'
+        return self.rate_limits.get(action.split('/')[0],
+            self.rate_limits['default'])
+
+    def _get_retry_delay(self, response, attempt):
+        try:
+            return int(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return self.BACKOFF_SECONDS * 2 ** attempt
+
+    def _request(self, method, action, **kwargs):
+        """Makes an API request once the rate limit of action allows it,
+        and retries it while CrowdIn responds with RETRY_STATUS_CODES.
+
+        Arguments:
+            method - 'get' or 'post'
+            action - like 'info', see _build_api_url()
+            kwargs - passed to requests, uploads in files are only retried
+                if they can be rewound
+
+        Returns:
+            The requests.Response.
+        """
+        url = self._build_api_url(action)
+        rate_limit = self._get_rate_limit(action)
+
+        files = kwargs.get('files') or {}
+        can_retry = all(_get_file_size(contents) is not None
+            for contents in files.itervalues())
+
+        attempt = 0
+        while True:
+            rate_limit.acquire()
+            response = self.session.request(method, url, **kwargs)
+
+            if (response.status_code not in self.RETRY_STATUS_CODES or
+                    not can_retry or attempt >= self.MAX_RETRIES):
+                return response
+
+            delay = self._get_retry_delay(response, attempt)
+            print 'CrowdIn responded %i to %s, retrying in %is' % (
+                response.status_code, action, delay)
+            response.close()
+
+            # Every request for this action waits, not only this one
+            rate_limit.pause(delay)
+            attempt += 1
+
+            for contents in files.itervalues():
+                if hasattr(contents, 'seek'):
+                    contents.seek(0)
+
     def _handle_error_response(self, response):
         if response.status_code != 200:
             print response.status_code, response.content
@@ -76,8 +464,6 @@ class CrowdInClient(object):
         """
         http://crowdin.net/page/api/edit-project
         """
-        url = self._build_api_url('edit-project')
-
         bool_fields = (
             'hide_duplicates',
             'export_approved_only',
@@ -89,7 +475,7 @@ class CrowdInClient(object):
             if kwargs.get(field) and isinstance(kwargs[field], bool):
                 kwargs[field] = str(int(kwargs[field]))
 
-        response = requests.post(url, data=kwargs)
+        response = self._request('post', 'edit-project', data=kwargs)
 
         if self._handle_error_response(response):
             return False
@@ -154,8 +540,36 @@ class CrowdInClient(object):
           }
         }
         """
-        project_info_url = self._build_api_url('info')
-        return requests.post(project_info_url).json()
+        project_info = self._request('post', 'info').json()
+        self._update_project_tree(project_info)
+        return project_info
+
+    def _update_project_tree(self, project_info):
+        """Replaces the cached ProjectTree if the project has changed since
+        it was listed, so it is only walked when something changed.
+        """
+        last_activity = project_info.get('details', {}).get('last_activity')
+        if (self.project_tree and last_activity and
+                self.project_tree.last_activity == last_activity):
+            return
+
+        files, dirs = self.get_files_and_dirs(project_info)
+        self.project_tree = ProjectTree(files, dirs, last_activity)
+
+    def get_project_tree(self):
+        """Returns the cached ProjectTree, listing the project the first time.
+
+        The tree is updated in place by add_directory() and add_files(), and
+        replaced whenever get_project_info() finds the project's
+        last_activity has changed, for example because of another client.
+        Call invalidate_project_tree() to list it again.
+        """
+        if self.project_tree is None:
+            self.get_project_info()
+        return self.project_tree
+
+    def invalidate_project_tree(self):
+        self.project_tree = None
 
     def get_files_and_dirs(self, project_info=None, dir_prefix=''):
         """Returns all files and directories currently in crowdin.
@@ -204,37 +618,240 @@ class CrowdInClient(object):
                 'built' means the .zip file was created and can be downloaded
                 'skipped' is returned if there have been no changes since the
                 last export
+                'throttled' is returned without calling CrowdIn if the last
+                export was less than EXPORT_INTERVAL ago, so there may be
+                changes which are not in the last export
                 TODO(mattfaus): Is 'skipped' also returned if you call more
                 frequently than once per 30 mins?
         """
+        next_export_time = self.get_next_export_time()
+        if time.time() < next_export_time:
+            print 'Skipping the export, the next one is allowed at %s' % (
+                time.ctime(next_export_time))
+            return 'throttled'
+
         self.edit_project(export_approved_only=approved_only)
 
-        url = self._build_api_url('export')
-        response = requests.post(url)
+        response = self._request('post', 'export')
 
         if self._handle_error_response(response):
             return response.json()
-        else:
-            return response.json()['success']['status']
 
-    def download_translations(self, package='all'):
+        status = response.json()['success']['status']
+        if status in self.EXPORT_SUCCESS_CODES:
+            self._set_last_export_time(time.time())
+        return status
+
+    def _load_export_times(self):
+        if not (self.export_times_path and
+                os.path.exists(self.export_times_path)):
+            return {}
+
+        with open(self.export_times_path, 'r') as export_times_file:
+            try:
+                export_times = json.load(export_times_file)
+            except ValueError:
+                export_times = None
+
+        if not isinstance(export_times, dict):
+            # As if no export was remembered, CrowdIn itself still limits
+            # how often a project is exported
+            print 'Ignoring the unreadable export times in', (
+                self.export_times_path)
+            return {}
+        return export_times
+
+    def _set_last_export_time(self, export_time):
+        """Writes the export times to a temporary file, then renames it over
+        the old one, so a crash never leaves a partly written file.
+        """
+        self.last_export_time = export_time
+        if not self.export_times_path:
+            return
+
+        export_times = self._load_export_times()
+        export_times[self.identifier] = export_time
+
+        temp_path = self.export_times_path + '.tmp'
+        with open(temp_path, 'w') as export_times_file:
+            json.dump(export_times, export_times_file, indent=2)
+
+        try:
+            os.rename(temp_path, self.export_times_path)
+        except OSError:
+            # Windows will not rename over an existing file
+            os.remove(self.export_times_path)
+            os.rename(temp_path, self.export_times_path)
+
+    def get_next_export_time(self):
+        """Returns the earliest time.time() at which build_export_zip() will
+        call CrowdIn, or 0 if it has not been called yet.
+        """
+        if self.last_export_time is None:
+            self.last_export_time = self._load_export_times().get(
+                self.identifier)
+
+        if self.last_export_time is None:
+            return 0
+        return self.last_export_time + self.EXPORT_INTERVAL
+
+    def download_translations(self, package='all', dest=None):
         """Download ZIP file with translations. You can choose the language of
         translation you need or download all of them at once.
 
         http://crowdin.net/page/api/download
 
+        Arguments:
+            dest - a path or a writable file-like object, like a
+                tempfile.TemporaryFile().  If provided, the zip is streamed
+                into it DOWNLOAD_CHUNK_SIZE bytes at a time, instead of
+                being held in memory.  Open it with CrowdInZipFile.from_path()
+                or CrowdInZipFile(dest).
+
         Returns:
-            The zip file.
+            The zip file, or dest if it was provided, or None on failure.
         """
-        url = self._build_api_url('download/%s.zip' % package)
-
-        response = requests.get(url)
+        response = self._request('get', 'download/%s.zip' % package,
+            stream=dest is not None)
 
         if self._handle_error_response(response):
             return None
-        else:
+        elif dest is None:
             return response.content
 
+        if isinstance(dest, basestring):
+            with open(dest, 'wb') as dest_file:
+                self._write_response(response, dest_file)
+        else:
+            self._write_response(response, dest)
+            dest.flush()
+            dest.seek(0)
+
+        return dest
+
+    def download_cached_translations(self, cache, package='all', export=False,
+        approved_only=True):
+        """Downloads translations like download_translations(), unless the
+        export in cache is still current.
+
+        The cached export is used if the project's last_build has not
+        changed since it was downloaded.  This is checked even when
+        build_export_zip() builds nothing, since the last export may have
+        been built by another client, or its download may have failed.
+
+        Arguments:
+            cache - an ExportCache
+            export - call build_export_zip() first
+
+        Returns:
+            The path to the zip, to open with CrowdInZipFile.from_path(), or
+            None on failure.
+        """
+        if export:
+            self.build_export_zip(approved_only)
+
+        last_build = self.get_project_info()['details']['last_build']
+
+        cached_path = cache.get(self.identifier, last_build, package)
+        if cached_path:
+            print 'Using the cached export from', last_build
+            return cached_path
+
+        download_path = cache.get_download_path(self.identifier, package)
+        if not self.download_translations(package, dest=download_path):
+            return None
+
+        return cache.set(self.identifier, last_build, download_path, package)
+
+    def get_translation_status(self):
+        """Returns the translation progress of each language, like: [
+            {
+              "code": "fr",
+              "name": "French",
+              "phrases": 1200,
+              "translated": 318,
+              "approved": 210,
+              "words": 9000,
+              "words_translated": 2300,
+              "words_approved": 1400,
+              "translated_progress": 26,
+              "approved_progress": 17
+            },
+            ...
+        ]
+
+        http://crowdin.net/page/api/status
+        """
+        return self._request('post', 'status').json()
+
+    def get_changed_languages(self, previous_status=None):
+        """Finds the languages which have had activity since previous_status.
+
+        CrowdIn does not say when each language last changed, so this
+        compares the counts from get_translation_status().  An edit which
+        leaves every count the same, like rewording an approved string, is
+        not noticed.
+
+        Arguments:
+            previous_status - the status returned by an earlier call, or
+                None to treat every language as changed
+
+        Returns (changed, status), where:
+            changed - a set of language codes
+            status - a JSON-serializable dict to keep for the next call
+        """
+        status = {}
+        for language in self.get_translation_status():
+            status[language['code']] = dict((key, value)
+                for key, value in language.iteritems()
+                if key not in ('code', 'name'))
+
+        previous_status = previous_status or {}
+        changed = set(code for code, counts in status.iteritems()
+            if previous_status.get(code) != counts)
+
+        return changed, status
+
+    def download_languages(self, dest_dir, languages=None, pool_size=4):
+        """Downloads the zip of each language concurrently, into
+        dest_dir/<language>.zip.  Open them all at once with
+        MergedCrowdInZipFile.from_paths().
+
+        Arguments:
+            languages - language codes, defaults to every language of the
+                project, see get_changed_languages() to only get some
+            pool_size - how many downloads to run at once
+
+        Returns:
+            A dict like {language: zip_path}, without the languages which
+            could not be downloaded.
+        """
+        if languages is None:
+            languages = [l['code'] for l in self.get_project_info()['languages']]
+
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+        def download(language):
+            path = os.path.join(dest_dir, '%s.zip' % language)
+            return language, self.download_translations(language, dest=path)
+
+        pool = multiprocessing.pool.ThreadPool(pool_size)
+        try:
+            results = pool.map(download, languages)
+        finally:
+            pool.close()
+            pool.join()
+
+        return dict((language, path) for language, path in results if path)
+
+    def _write_response(self, response, dest_file):
+        try:
+            for chunk in response.iter_content(self.DOWNLOAD_CHUNK_SIZE):
+                dest_file.write(chunk)
+        finally:
+            response.close()
+
 
     # Upload-related functions
     ###########################################################################
@@ -243,17 +860,67 @@ class CrowdInClient(object):
         """
         http://crowdin.net/page/api/add-directory
         """
-        url = self._build_api_url('add-directory')
         data = { 'name': name }
 
-        response = requests.post(url, data=data)
+        response = self._request('post', 'add-directory', data=data)
 
         if response.status_code != 200:
             print response.status_code, response.content
             return False
         else:
+            if self.project_tree:
+                self.project_tree.add_directory(name)
             return True
 
+    def create_directories(self, names, workers=None):
+        """Creates directories and any of their parents which are missing.
+
+        Parents are created before their children: all missing directories
+        at one depth are created concurrently, then the next depth.
+        Directories already in the project tree are skipped, and so are the
+        children of a directory which could not be created.
+
+        Arguments:
+            names - directory names like 'dir/subdir/'
+            workers - how many requests to make at once
+
+        Returns:
+            A set of the directories which were not created.
+        """
+        existing_dirs = self.get_project_tree().dirs
+
+        missing_by_depth = collections.defaultdict(set)
+        for name in names:
+            parts = ProjectTree.get_dir_path(name).split('/')[:-1]
+            for depth in xrange(1, len(parts) + 1):
+                path = '/'.join(parts[:depth]) + '/'
+                if path not in existing_dirs:
+                    missing_by_depth[depth].add(path)
+
+        if not missing_by_depth:
+            return set()
+
+        failed_dirs = set()
+        pool = multiprocessing.pool.ThreadPool(workers or self.UPLOAD_WORKERS)
+        try:
+            for depth in sorted(missing_by_depth):
+                level = []
+                for path in sorted(missing_by_depth[depth]):
+                    parent = path[:path.rstrip('/').rfind('/') + 1]
+                    if parent in failed_dirs:
+                        failed_dirs.add(path)
+                    else:
+                        level.append(path)
+
+                created = pool.map(self.add_directory, level)
+                failed_dirs.update(path for path, ok in zip(level, created)
+                    if not ok)
+        finally:
+            pool.close()
+            pool.join()
+
+        return failed_dirs
+
     def sync_files(self, files):
         """Intelligently adds or updates files by checking to see if they
         already exist on CrowdIn and issuing the relevant call.
@@ -265,34 +932,49 @@ class CrowdInClient(object):
                 'full/file/path/video.pot': file-like-object of contents
             }
 
+        Returns:
+            A dict like {path: error_message} of the files which failed.
         """
-        existing_files, existing_dirs = self.get_files_and_dirs()
+        project_tree = self.get_project_tree()
+        existing_files = project_tree.files
+        existing_dirs = project_tree.dirs
 
         files_to_upload = set(files.keys())
-        directories_to_upload = set([f[:f.rfind('/')+1] for f in files_to_upload])
+        directories_to_upload = set([f[:f.rfind('/')+1] for f in files_to_upload
+            if '/' in f])
 
-        add_directories = directories_to_upload - existing_dirs
-        for add_dir in add_directories:
-            self.add_directory(add_dir)
+        self.create_directories(directories_to_upload - existing_dirs)
 
         add_files = sorted(files_to_upload - existing_files)
-        delete_files = sorted(existing_files - files_to_upload)
         update_files = sorted(files_to_upload & existing_files)
 
-        self.add_files({ k:files[k] for k in add_files })
-        self.update_files({ k:files[k] for k in update_files })
+        error_files = self.add_files({ k:files[k] for k in add_files })
+        error_files.update(self.update_files({ k:files[k] for k in update_files }))
 
-        # TODO(mattfaus): Return (error_files, to_delete_files)
+        # TODO(mattfaus): Return to_delete_files too
+        return error_files
 
-    def _split_dict(self, files, batch_size):
-        """Returns two dicts: the first contains the first batch_size entries,
-        the next contains everything else.
+    def _iter_batches(self, files, batch_size, max_batch_bytes):
+        """Yields dicts of at most batch_size of the files, and at most
+        max_batch_bytes of contents, unless a single file is larger.
         """
-        items = files.items()  # Does not return repeatable results
-        return (
-            dict(items[:batch_size]),
-            dict(items[batch_size:])
-        )
+        batch = {}
+        batch_bytes = 0
+
+        for path, contents in files.iteritems():
+            size = _get_file_size(contents)
+
+            if batch and (len(batch) >= batch_size or
+                    batch_bytes + size > max_batch_bytes):
+                yield batch
+                batch = {}
+                batch_bytes = 0
+
+            batch[path] = contents
+            batch_bytes += size
+
+        if batch:
+            yield batch
 
     def _format_files_dict(self, files):
         """Translates a file dict to the special naming CrowdIn wants."""
@@ -302,34 +984,85 @@ class CrowdInClient(object):
 
         return formatted_dict
 
-    def _upload_files(self, action, files, batch_size):
+    @staticmethod
+    def _get_error_message(response):
+        try:
+            return response.json()['error']['message']
+        except (ValueError, KeyError, TypeError):
+            return '%s %s' % (response.status_code, response.content)
+
+    def _upload_batch(self, action, files_batch):
+        """Uploads one batch of files.  If the batch fails, its files are
+        retried one at a time, so one bad file does not fail the others.
+
+        Returns:
+            A dict like {path: error_message} of the files which failed.
         """
+        response = self._request('post', action,
+            files=self._format_files_dict(files_batch))
+        if response.status_code == 200:
+            return {}
+
+        message = self._get_error_message(response)
+        if len(files_batch) == 1:
+            return dict.fromkeys(files_batch, message)
+
+        errors = {}
+        for path, contents in files_batch.iteritems():
+            if hasattr(contents, 'seek'):
+                contents.seek(0)
+            errors.update(self._upload_batch(action, {path: contents}))
+        return errors
+
+    def _upload_files(self, action, files, batch_size=None,
+        max_batch_bytes=None, workers=None):
+        """Uploads files in batches, several batches at once.
 
         Arguments:
             action - one of ('add-file', 'update-file')
             files - A dict like: {
                 'full/file/path/video.pot': file-like-object of contents
             }
-            batch_size - how many files to upload at once
-        """
-        url = self._build_api_url(action)
-        error_files = []
-
-        while files:
-            files_batch, files = self._split_dict(files, batch_size)
-            files_batch = self._format_files_dict(files_batch)
-
-            response = requests.post(url, files=files_batch)
+            batch_size - how many files to upload in one request
+            max_batch_bytes - the most contents to upload in one request,
+                though a larger file is still sent on its own
+            workers - how many requests to make at once
 
-            if response.status_code != 200:
-                print response.status_code, response.content
-                # TODO(mattfaus): Parse the response better, I imagine there
-                # is 1 error message per file attempted
-                error_files += files_batch.keys()
+        Returns:
+            A dict like {path: error_message} of the files which failed.
+        """
+        if not files:
+            return {}
+
+        # A failed batch is retried one file at a time, so read any stream
+        # which cannot be rewound, like format.TranscriptStream, while it is
+        # still whole
+        files = dict((path, contents.read()
+                if _get_file_size(contents) is None else contents)
+            for path, contents in files.iteritems())
+
+        batches = self._iter_batches(files,
+            batch_size or self.UPLOAD_BATCH_SIZE,
+            max_batch_bytes or self.UPLOAD_BATCH_BYTES)
+
+        error_files = {}
+
+        pool = multiprocessing.pool.ThreadPool(workers or self.UPLOAD_WORKERS)
+        try:
+            for errors in pool.imap_unordered(
+                    lambda files_batch: self._upload_batch(action, files_batch),
+                    batches):
+                for path, message in errors.iteritems():
+                    print 'Could not %s %s: %s' % (action, path, message)
+                error_files.update(errors)
+        finally:
+            pool.close()
+            pool.join()
 
         return error_files
 
-    def add_files(self, files, batch_size=10):
+    def add_files(self, files, batch_size=None, max_batch_bytes=None,
+        workers=None):
         """
         http://crowdin.net/page/api/add-file
 
@@ -337,10 +1070,23 @@ class CrowdInClient(object):
             files - A dict like: {
                 'full/file/path/video.pot': file-like-object of contents
             }
+            batch_size, max_batch_bytes, workers - see _upload_files()
+
+        Returns:
+            A dict like {path: error_message} of the files which failed.
         """
-        return self._upload_files('add-file', files, batch_size)
+        error_files = self._upload_files('add-file', files, batch_size,
+            max_batch_bytes, workers)
+
+        if self.project_tree:
+            for path in files:
+                if path not in error_files:
+                    self.project_tree.add_file(path)
+
+        return error_files
 
-    def update_files(self, files, batch_size=10):
+    def update_files(self, files, batch_size=None, max_batch_bytes=None,
+        workers=None):
         """
         http://crowdin.net/page/api/update-file
 
@@ -348,12 +1094,161 @@ class CrowdInClient(object):
             files - A dict like: {
                 'full/file/path/video.pot': file-like-object of contents
             }
+            batch_size, max_batch_bytes, workers - see _upload_files()
+
+        Returns:
+            A dict like {path: error_message} of the files which failed.
+        """
+        return self._upload_files('update-file', files, batch_size,
+            max_batch_bytes, workers)
+
+
+
+class UploadQueue(object):
+    """Collects files to upload during a sync, and uploads them together
+    with CrowdInClient.sync_files(), which splits them into batches by
+    count and size and creates each missing directory once.
+
+    Files are uploaded when flush() is called, or as soon as more than
+    max_pending_bytes are waiting, so memory use stays bounded.
+    """
+
+    def __init__(self, client, max_pending_bytes=64 * 1024 * 1024):
+        """
+        Arguments:
+            client - a CrowdInClient
         """
-        return self._upload_files('update-file', files, batch_size)
+        self.client = client
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_files = {}
+        self.pending_bytes = 0
+        self.error_files = {}
+
+    def __len__(self):
+        return len(self.pending_files)
+
+    def add(self, path, contents):
+        """Queues a file, like sync_files({path: contents})."""
+        if path in self.pending_files:
+            self.pending_bytes -= _get_file_size(self.pending_files[path])
+
+        if _get_file_size(contents) is None:
+            # Read now, so it can be measured and retried
+            contents = contents.read()
+
+        self.pending_files[path] = contents
+        self.pending_bytes += _get_file_size(contents)
+
+        if self.pending_bytes > self.max_pending_bytes:
+            self.flush()
+
+    def flush(self):
+        """Uploads every queued file.
+
+        Returns:
+            A dict like {path: error_message} of the files which failed,
+            since the queue was created.
+        """
+        if self.pending_files:
+            print 'Uploading %i files to CrowdIn' % len(self.pending_files)
+            self.error_files.update(self.client.sync_files(self.pending_files))
+
+        self.pending_files = {}
+        self.pending_bytes = 0
+        return self.error_files
+
+
+class AsyncCrowdInClient(object):
+    """Runs CrowdInClient calls in the background, so several of them can
+    overlap with each other, and with YouTube requests made meanwhile.
+
+    Each method takes the same arguments as the CrowdInClient method of the
+    same name, but returns at once with a multiprocessing.pool.AsyncResult.
+    Call its get() to wait for the return value, or ready() to check on it.
+
+    Each kind of call has its own pool of CONCURRENCY_LIMITS threads, so
+    calls waiting for their turn do not hold up calls of another kind.  All
+    calls share the client's requests.Session, whose connection pool is
+    CrowdInClient.CONNECTION_POOL_SIZE, and at most that many run at once.
+    """
+
+    # The most calls of each method which may run at once.  Each upload
+    # call makes up to CrowdInClient.UPLOAD_WORKERS requests itself, and
+    # CrowdIn only allows one export at a time.
+    CONCURRENCY_LIMITS = {
+        'get_project_info': 4,
+        'build_export_zip': 1,
+        'download_translations': 4,
+        'download_cached_translations': 1,
+        'add_files': 2,
+        'update_files': 2,
+    }
+
+    def __init__(self, client):
+        """
+        Arguments:
+            client - a CrowdInClient
+        """
+        self.client = client
+        self.connections = threading.BoundedSemaphore(
+            client.CONNECTION_POOL_SIZE)
+
+        # Created on first use, see _get_pool()
+        self.pools = {}
+        self.pools_lock = threading.Lock()
+
+    def _get_pool(self, name):
+        with self.pools_lock:
+            if name not in self.pools:
+                self.pools[name] = multiprocessing.pool.ThreadPool(
+                    self.CONCURRENCY_LIMITS[name])
+            return self.pools[name]
+
+    def _call_async(self, name, *args, **kwargs):
+        method = getattr(self.client, name)
+
+        def call():
+            with self.connections:
+                return method(*args, **kwargs)
+
+        return self._get_pool(name).apply_async(call)
+
+    def get_project_info(self):
+        return self._call_async('get_project_info')
+
+    def build_export_zip(self, approved_only=True):
+        return self._call_async('build_export_zip', approved_only)
+
+    def download_translations(self, package='all', dest=None):
+        return self._call_async('download_translations', package, dest)
+
+    def download_cached_translations(self, cache, package='all', export=False,
+        approved_only=True):
+        return self._call_async('download_cached_translations', cache,
+            package, export, approved_only)
+
+    def add_files(self, files, batch_size=None, max_batch_bytes=None,
+        workers=None):
+        return self._call_async('add_files', files, batch_size,
+            max_batch_bytes, workers)
+
+    def update_files(self, files, batch_size=None, max_batch_bytes=None,
+        workers=None):
+        return self._call_async('update_files', files, batch_size,
+            max_batch_bytes, workers)
+
+    def close(self):
+        """Waits for every call to finish."""
+        for pool in self.pools.itervalues():
+            pool.close()
+        for pool in self.pools.itervalues():
+            pool.join()
 
 
 # A quick test to make sure your CrowdIn credentials are working
 if __name__ == "__main__":
+    import secrets
+
     client = CrowdInClient(secrets.crowdin_ident, secrets.crowdin_key)
 
     print json.dumps(client.get_project_info(), indent=2)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import cStringIO
+import json
 import os
 import zipfile
 
@@ -42,90 +43,222 @@ DISPLAY_NAMES = {
     'zh-TW': 'Chinese - Taiwan',
 }
 
+# Where TrackFingerprints are kept between runs
+FINGERPRINTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'track_fingerprints.json')
+
+# Where the last CrowdIn export is kept between runs, see crowdin.ExportCache
+EXPORT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'export_cache')
+
+# When CrowdIn last built an export, which it only allows every 30 minutes
+EXPORT_TIMES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'export_times.json')
+
 def get_display_name_for_locale_code(locale_code):
     # TODO(mattfaus): Do something more elegant here
     return DISPLAY_NAMES.get(locale_code) or locale_code
 
 
-def perform_full_sync(export=False):
+def read_po_translation(po_content, language):
+    """Converts a translation from the CrowdIn export into .sub content.
+    Every track is read the same way, so its fingerprint is the same
+    whichever way it is synced.
+
+    Returns:
+        A tuple of (.sub content, fingerprint) from
+        format.transcode_po_to_sub(), or None if the translation could not
+        be parsed, so one bad file does not stop the whole sync.
+    """
+    try:
+        return format.transcode_po_to_sub(po_content, fingerprint=True)
+    except ValueError, e:
+        print '-- Could not parse the translation for %s: %s' % (language, e)
+        return None
+
+
+class TrackFingerprints(object):
+    """Remembers the format.TranscriptReader.fingerprint() of every caption
+    track this tool has written to YouTube, so unchanged translations can
+    be skipped without downloading the track.  Stored as a JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprints = {}
+
+        if os.path.isfile(path):
+            with open(path, 'r') as fingerprints_file:
+                try:
+                    self.fingerprints = json.load(fingerprints_file)
+                except ValueError:
+                    # Every track will be compared with YouTube instead
+                    print 'Ignoring the unreadable fingerprints in', path
+
+    @staticmethod
+    def _key(video_id, language):
+        return '%s:%s' % (video_id, language)
+
+    def get(self, video_id, language):
+        return self.fingerprints.get(self._key(video_id, language))
+
+    def set(self, video_id, language, fingerprint):
+        self.fingerprints[self._key(video_id, language)] = fingerprint
+
+    def save(self):
+        """Writes the fingerprints to a temporary file, then renames it over
+        the old one, so a crash never leaves a partly written file.
+        """
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fingerprints_file:
+            json.dump(self.fingerprints, fingerprints_file, indent=0,
+                sort_keys=True)
+
+        try:
+            os.rename(temp_path, self.path)
+        except OSError:
+            # Windows will not rename over an existing file
+            os.remove(self.path)
+            os.rename(temp_path, self.path)
+
+
+def perform_full_sync(export=False, fingerprints_path=FINGERPRINTS_PATH,
+    export_cache_dir=EXPORT_CACHE_DIR, export_times_path=EXPORT_TIMES_PATH):
 
     # Initialize client libraries
     yt_client = youtube.YouTubeCaptionEditor(secrets.google_email,
         secrets.google_password, secrets.youtube_username)
 
-    ci_client = crowdin.CrowdInClient(secrets.crowdin_ident, secrets.crowdin_key)
+    ci_client = crowdin.CrowdInClient(secrets.crowdin_ident, secrets.crowdin_key,
+        export_times_path)
 
-    # Build and download the CrowdIn captions
+    fingerprints = TrackFingerprints(fingerprints_path)
+    upload_queue = crowdin.UploadQueue(ci_client)
 
-    if export:
-        ci_client.build_export_zip()
-
-    zipped_translations = crowdin.CrowdInZipFile(ci_client.download_translations())
-    print 'Found %i translation files' % zipped_translations.get_file_count()
+    # Build and download the CrowdIn captions in the background, while the
+    # YouTube videos are pulled.  Downloaded to disk, only if it changed
+    # since the last run
+    async_client = crowdin.AsyncCrowdInClient(ci_client)
+    export_result = async_client.download_cached_translations(
+        crowdin.ExportCache(export_cache_dir), export=export)
 
     # Pull the YouTube videos
     yt_client.get_videos()
     print 'Found %i videos on YouTube' % len(yt_client.videos)
 
-    for video_id, video in yt_client.videos.iteritems():
-        print 'Processing', video_id, video.title
+    export_path = export_result.get()
+    async_client.close()
+    if not export_path:
+        print 'Could not download the CrowdIn translations'
+        return
 
-        po_path = crowdin.CrowdInZipFile.get_po_path(video.title, video_id)
+    zipped_translations = crowdin.CrowdInZipFile.from_path(export_path)
+    print 'Found %i translation files' % zipped_translations.get_file_count()
 
-        existing_translations = zipped_translations.get_all_translations(po_path)
+    # Fingerprints are saved even if the sync fails part way, so the tracks
+    # which were written are not written again next time
+    try:
+        for video_id, video in yt_client.videos.iteritems():
+            print 'Processing', video_id, video.title
 
-        if existing_translations:
-            print '-- Captions found, updating YouTube with %i translations' % len(existing_translations)
+            po_path = crowdin.CrowdInZipFile.get_po_path(video.title, video_id)
 
-            video.get_caption_tracks()
-            for src, caption_track in video.caption_tracks.iteritems():
-                # Update existing tracks
-                new_po_content = existing_translations.get(caption_track.language)
-                if not new_po_content:
-                    # How did this track get on YouTube, wasn't this tool!
-                    print '-- Corresponding track not found for', caption_track.language
-                    continue
+            existing_translations = zipped_translations.get_all_translations(po_path)
+
+            if existing_translations:
+                print '-- Captions found, updating YouTube with %i translations' % len(existing_translations)
 
-                po_reader = format.PotTranscriptReader(new_po_content)
-                sub_writer = format.SubTranscriptWriter(po_reader)
+                video.get_caption_tracks()
+                for src, caption_track in video.caption_tracks.iteritems():
+                    # Update existing tracks
+                    new_po_content = existing_translations.get(caption_track.language)
+                    if not new_po_content:
+                        # How did this track get on YouTube, wasn't this tool!
+                        print '-- Corresponding track not found for', caption_track.language
+                        continue
 
-                print '-- Uploading an updated track for', caption_track.language
-                yt_client.update_track(video_id, caption_track.track_id, sub_writer.content)
+                    translation = read_po_translation(new_po_content,
+                        caption_track.language)
+                    if translation is None:
+                        del existing_translations[caption_track.language]
+                        continue
 
-                # Remove it from the list, so we know this does not need to
-                # be added
-                del existing_translations[caption_track.language]
+                    # Only write to YouTube if the translation has changed
+                    new_content, new_fingerprint = translation
 
-            # These are newly approved translations that need to be added
-            for lang, po_content in existing_translations.iteritems():
-                po_reader = format.PotTranscriptReader(po_content)
-                sub_writer = format.SubTranscriptWriter(po_reader)
+                    if new_fingerprint == fingerprints.get(video_id, caption_track.language):
+                        print '-- Track fingerprint is unchanged for', caption_track.language
+                    else:
+                        new_reader = format.SubTranscriptReader(new_content)
+                        try:
+                            old_reader = format.SubTranscriptReader(
+                                caption_track.download_track())
+                            diff = format.diff_transcripts(old_reader, new_reader)
+                        except ValueError, e:
+                            # Treated as changed, so the track is rewritten
+                            print '-- Could not parse the YouTube track for %s: %s' % (
+                                caption_track.language, e)
+                            diff = None
 
-                display_name = get_display_name_for_locale_code(lang)
+                        if diff is not None and diff.is_noop:
+                            print '-- Track is unchanged for', caption_track.language
+                        else:
+                            if diff is not None:
+                                print '-- Uploading an updated track for %s (%i added, %i removed, %i changed)' % (
+                                    caption_track.language, len(diff.added),
+                                    len(diff.removed), len(diff.changed))
+                            else:
+                                print '-- Uploading an updated track for', caption_track.language
+                            yt_client.update_track(video_id, caption_track.track_id,
+                                new_content)
 
-                print '-- Uploading a new track for', display_name
-                yt_client.add_track(video_id, display_name, lang, sub_writer.content)
-        else:
-            print '-- No captions found in CrowdIn, attempting to upload'
+                        fingerprints.set(video_id, caption_track.language,
+                            new_fingerprint)
 
-            # Get the machine-generated caption-track from YT
-            machine_track = video.get_machine_generated_track()
+                    # Remove it from the list, so we know this does not need to
+                    # be added
+                    del existing_translations[caption_track.language]
 
-            # Can't do anything of there isn't a machine-generated track
-            if not machine_track:
-                print '-- Did not have a machine-generated track.'
-                continue
+                # These are newly approved translations that need to be added
+                for lang, po_content in existing_translations.iteritems():
+                    translation = read_po_translation(po_content, lang)
+                    if translation is None:
+                        continue
+
+                    content, fingerprint = translation
+
+                    display_name = get_display_name_for_locale_code(lang)
+
+                    print '-- Uploading a new track for', display_name
+                    yt_client.add_track(video_id, display_name, lang, content)
+                    fingerprints.set(video_id, lang, fingerprint)
+            else:
+                print '-- No captions found in CrowdIn, attempting to upload'
+
+                # Get the machine-generated caption-track from YT
+                machine_track = video.get_machine_generated_track()
+
+                # Can't do anything of there isn't a machine-generated track
+                if not machine_track:
+                    print '-- Did not have a machine-generated track.'
+                    continue
 
-            # Convert to .po format
-            sub_reader = format.SubTranscriptReader(machine_track.track_content)
-            pot_writer = format.PotTranscriptWriter(sub_reader)
+                # Convert to .po format
+                sub_reader = format.SubTranscriptReader(machine_track.track_content)
+                pot_writer = format.PoCatalogWriter(sub_reader)
 
-            # Upload to CrowdIn
-            # TODO(mattfaus): sync_files() can batch things, maybe that's faster?
-            print '-- Uploading machine-generated captions to CrowdIn:', po_path
-            ci_client.sync_files({
-                po_path: pot_writer.get_file()
-            })
+                # Queued, so they are uploaded to CrowdIn in a few batches
+                print '-- Queueing machine-generated captions for CrowdIn:', po_path
+                upload_queue.add(po_path, pot_writer.get_file())
+    finally:
+        # Whatever was queued before a failure is still uploaded
+        try:
+            error_files = upload_queue.flush()
+            for po_path, message in sorted(error_files.iteritems()):
+                print 'Could not upload %s: %s' % (po_path, message)
+        finally:
+            fingerprints.save()
+            zipped_translations.close()
 
 
 if __name__ == "__main__":
@@ -135,5 +268,6 @@ if __name__ == "__main__":
 
     perform_full_sync(export=True)
 
-    # Do this to build a new export, but it only works every 30 mins
+    # Do this to build a new export, it is skipped if the last one was less
+    # than 30 mins ago
     # perform_full_sync(export=True)
@@ -1,19 +1,502 @@
-import cStringIO
+import array
+import hashlib
+import json
+import math
+import mmap
+import os
 import re
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# 0:00:01.389, also SRT's 00:00:01,389 and WebVTT's 00:01.389
+REGEX_IRREGULAR_TIMESTAMP = re.compile(
+    r'^\s*(?:(?P<hours>\d+):)?(?P<minutes>\d+):(?P<seconds>\d+)'
+    r'(?:[.,](?P<fraction>\d+))?\s*$')
+
+DEFAULT_TIMESTAMP_FORMAT = '%d:%02d:%02d.%03d'
+
+# Memos for timestamp_to_ms(), parse_timing() and ms_to_timestamp(), which
+# are cleared when they reach TIMESTAMP_CACHE_SIZE entries.  Cues usually end
+# when the next one starts, so most timestamps are seen twice, and each
+# translation of a video repeats the timings of the others.
+TIMESTAMP_CACHE_SIZE = 100000
+_timestamp_to_ms_cache = {}
+_parse_timing_cache = {}
+_ms_to_timestamp_caches = {}
+
+# Milliseconds for the ':SS' and '.mmm' ends of a timestamp, and for each
+# 'H:MM' (or 'MM') start seen so far, so _fixed_timestamp_to_ms() can add up
+# three dict lookups instead of parsing digits.
+_SECONDS_MS = dict((':%02d' % seconds, seconds * 1000)
+    for seconds in xrange(60))
+_MILLIS_MS = dict(('%s%03d' % (separator, millis), millis)
+    for separator in '.,' for millis in xrange(1000))
+_CLOCK_MS = {}
+
+
+def _fixed_timestamp_to_ms(timestamp):
+    """Parses H:MM:SS.mmm (any number of hour digits), MM:SS.mmm, or the
+    same with a ',' before the milliseconds, by slicing at fixed offsets
+    from the end.  Returns None if timestamp has some other shape.
+    """
+    try:
+        return (_CLOCK_MS[timestamp[:-7]] + _SECONDS_MS[timestamp[-7:-4]]
+            + _MILLIS_MS[timestamp[-4:]])
+    except KeyError:
+        pass
+
+    length = len(timestamp)
+    if (length < 9 or timestamp[-4] not in '.,' or timestamp[-7] != ':'):
+        return None
+
+    if length == 9:
+        hours = 0
+    elif timestamp[-10] == ':' and timestamp[:-10].isdigit():
+        hours = int(timestamp[:-10])
+    else:
+        return None
+
+    # MMSSmmm, parsed as one number.  int() would also accept signs and
+    # spaces, which the regex rejects.
+    digits = timestamp[-9:-7] + timestamp[-6:-4] + timestamp[-3:]
+    if not digits.isdigit():
+        return None
+
+    value = int(digits)
+    clock_ms = (hours * 60 + value // 100000) * 60000
+
+    if len(_CLOCK_MS) >= TIMESTAMP_CACHE_SIZE:
+        _CLOCK_MS.clear()
+    _CLOCK_MS[timestamp[:-7]] = clock_ms
+    return clock_ms + value % 100000
+
+
+def _irregular_timestamp_to_ms(timestamp):
+    match = REGEX_IRREGULAR_TIMESTAMP.match(timestamp)
+    if not match:
+        raise ValueError('Timestamp not understood: %r' % timestamp)
+
+    hours, minutes, seconds, fraction = match.groups()
+    ms = ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000
+    if fraction:
+        ms += int(round(float('0.' + fraction) * 1000))
+    return ms
+
+
+def timestamp_to_ms(timestamp):
+    """Converts a timestamp like 0:00:01.389 into integer milliseconds.
+
+    Also accepts the SRT (00:00:01,389) and WebVTT (00:01.389) variants.
+    Timestamps missing milliseconds, or with too few or too many digits,
+    fall back to a regex.
+    """
+    try:
+        return _timestamp_to_ms_cache[timestamp]
+    except KeyError:
+        pass
+
+    ms = _fixed_timestamp_to_ms(timestamp)
+    if ms is None:
+        ms = _irregular_timestamp_to_ms(timestamp)
+
+    if len(_timestamp_to_ms_cache) >= TIMESTAMP_CACHE_SIZE:
+        _timestamp_to_ms_cache.clear()
+    _timestamp_to_ms_cache[timestamp] = ms
+    return ms
+
+
+def ms_to_timestamp(ms, timestamp_format=DEFAULT_TIMESTAMP_FORMAT):
+    """Converts integer milliseconds into a timestamp like 0:00:01.389.
+
+    Arguments:
+        timestamp_format - formats (hours, minutes, seconds, milliseconds)
+    """
+    cache = _ms_to_timestamp_caches.get(timestamp_format)
+    if cache is None:
+        cache = _ms_to_timestamp_caches[timestamp_format] = {}
+    else:
+        try:
+            return cache[ms]
+        except KeyError:
+            pass
+
+    seconds, millis = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    timestamp = timestamp_format % (hours, minutes, seconds, millis)
+
+    if len(cache) >= TIMESTAMP_CACHE_SIZE:
+        cache.clear()
+    cache[ms] = timestamp
+    return timestamp
+
+
+def parse_timing(timing):
+    """Converts a timing like 0:00:01.389,0:00:06.839 into a tuple of
+    (start, end) milliseconds.
+
+    Returns:
+        None if timing is not exactly two H:MM:SS.mmm timestamps, in which
+        case callers should fall back to TranscriptReader.REGEX_TIMESTAMP.
+    """
+    try:
+        return _parse_timing_cache[timing]
+    except KeyError:
+        pass
+
+    start, comma, end = timing.partition(',')
+    if not comma or len(start) < 11 or len(end) < 11:
+        return None
+
+    start_ms = _fixed_timestamp_to_ms(start)
+    end_ms = _fixed_timestamp_to_ms(end)
+    if start_ms is None or end_ms is None:
+        return None
+
+    if len(_parse_timing_cache) >= TIMESTAMP_CACHE_SIZE:
+        _parse_timing_cache.clear()
+    _parse_timing_cache[timing] = start_ms, end_ms
+    return start_ms, end_ms
+
+
+def format_timing(start, end):
+    """Converts start and end milliseconds into 0:00:01.389,0:00:06.839"""
+    return '%s,%s' % (ms_to_timestamp(start), ms_to_timestamp(end))
+
+
+def _update_fingerprint(digest, start, end, text):
+    """Adds a cue to a TranscriptReader.fingerprint() digest."""
+    if not isinstance(text, unicode):
+        text = text.decode('utf-8')
+
+    digest.update('%d,%d\n' % (start, end))
+    digest.update(u' '.join(text.split()).encode('utf-8'))
+    digest.update('\n\n')
+
+
+class Cue(object):
+    """A single subtitle entry, with start and end times in milliseconds."""
+    __slots__ = ('start', 'end', 'text')
+
+    def __init__(self, start, end, text):
+        self.start = start
+        self.end = end
+        self.text = text
+
+    @property
+    def timestamp(self):
+        """The timing formatted like 0:00:01.389,0:00:06.839"""
+        return format_timing(self.start, self.end)
+
+    def __eq__(self, other):
+        return (isinstance(other, Cue) and self.start == other.start and
+            self.end == other.end and self.text == other.text)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Cue(%r, %r, %r)' % (self.start, self.end, self.text)
+
+
+class CueIntervalIndex(object):
+    """Answers which cues overlap a time, or a time range, in O((k + 1) log n)
+    for k cues found.
+
+    Cues are stored sorted by start time, and treated as an implicit
+    balanced binary tree: the root of the range [lo, hi) is its middle
+    element.  Each element also stores the latest end time in its subtree,
+    so queries can skip subtrees which end too early.
+    """
+
+    def __init__(self, starts, ends):
+        """
+        Arguments:
+            starts, ends - sequences of cue start and end times, in
+                milliseconds, sorted by start time
+        """
+        self.starts = starts
+        self.ends = ends
+        self.max_ends = array.array('l', ends)
+        self._build(0, len(starts))
+
+    @classmethod
+    def from_cues(cls, cues):
+        """Builds an index over a list of Cue objects sorted by start."""
+        return cls(array.array('l', (cue.start for cue in cues)),
+            array.array('l', (cue.end for cue in cues)))
+
+    def _build(self, lo, hi):
+        """Fills in max_ends for the subtree [lo, hi), returns its max."""
+        if lo >= hi:
+            return None
+
+        mid = (lo + hi) // 2
+        latest = self.max_ends[mid]
+        for subtree_max in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if subtree_max is not None and subtree_max > latest:
+                latest = subtree_max
+
+        self.max_ends[mid] = latest
+        return latest
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlapping(self, start, end):
+        """Returns the indexes, in order, of the cues which overlap the time
+        range [start, end), those with cue.start < end and cue.end > start.
+        """
+        found = []
+        self._query(0, len(self.starts), start, end, found)
+        return found
+
+    def at(self, ms):
+        """Returns the indexes, in order, of the cues showing at ms."""
+        return self.overlapping(ms, ms + 1)
+
+    def _query(self, lo, hi, start, end, found):
+        if lo >= hi:
+            return
+
+        mid = (lo + hi) // 2
+        if self.max_ends[mid] <= start:
+            # Everything in this subtree ends too early
+            return
+
+        self._query(lo, mid, start, end, found)
+
+        if self.starts[mid] < end:
+            if self.ends[mid] > start:
+                found.append(mid)
+
+            # Later cues can only start after this one
+            self._query(mid + 1, hi, start, end, found)
+
+
+class CueTimings(object):
+    """The start and end times of a transcript's cues, packed into arrays so
+    they can be re-timed in bulk.
+
+    Uses NumPy int64 arrays when NumPy is installed, and array('l') arrays
+    otherwise.  The operations change the timings in place and return self,
+    so they can be chained, then TranscriptReader.set_timings() writes them
+    back to the cues:
+
+        timings = reader.get_timings().shift(-500).snap(29.97)
+        reader.set_timings(timings.repair_overlaps())
+    """
+
+    def __init__(self, starts, ends):
+        """
+        Arguments:
+            starts, ends - sequences of cue start and end times, in
+                milliseconds, sorted by start time
+        """
+        if numpy is not None:
+            self.starts = numpy.array(starts, dtype=numpy.int64)
+            self.ends = numpy.array(ends, dtype=numpy.int64)
+        else:
+            self.starts = array.array('l', starts)
+            self.ends = array.array('l', ends)
+
+    @classmethod
+    def from_cues(cls, cues):
+        return cls([cue.start for cue in cues], [cue.end for cue in cues])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _map(self, function):
+        """Applies function to every start and end time.  function takes and
+        returns a NumPy array, or a single number if NumPy is missing.
+        """
+        if numpy is not None:
+            self.starts = function(self.starts).astype(numpy.int64)
+            self.ends = function(self.ends).astype(numpy.int64)
+        else:
+            self.starts = array.array('l', (int(function(t)) for t in self.starts))
+            self.ends = array.array('l', (int(function(t)) for t in self.ends))
+        return self
+
+    def shift(self, ms):
+        """Moves every cue by ms, which may be negative.  Times are clipped
+        at zero.
+        """
+        if numpy is not None:
+            return self._map(lambda times: numpy.maximum(times + ms, 0))
+        return self._map(lambda time: max(time + ms, 0))
+
+    def scale(self, factor, origin=0):
+        """Stretches every time away from origin by factor, for example
+        25 / 23.976 to fix frame rate drift.
+        """
+        if factor <= 0:
+            raise ValueError('factor must be positive')
+
+        if numpy is not None:
+            return self._map(lambda times:
+                numpy.floor((times - origin) * factor + origin + 0.5))
+        return self._map(lambda time:
+            math.floor((time - origin) * factor + origin + 0.5))
+
+    def snap(self, fps):
+        """Rounds every time to the nearest frame boundary at fps."""
+        frame_ms = 1000.0 / fps
+
+        if numpy is not None:
+            return self._map(lambda times:
+                numpy.floor(numpy.floor(times / frame_ms + 0.5) * frame_ms + 0.5))
+        return self._map(lambda time:
+            math.floor(math.floor(time / frame_ms + 0.5) * frame_ms + 0.5))
+
+    def find_overlaps(self):
+        """Returns the indexes of cues which end after the next cue starts."""
+        if numpy is not None:
+            return numpy.nonzero(self.ends[:-1] > self.starts[1:])[0].tolist()
+        return [i for i in xrange(len(self.starts) - 1)
+            if self.ends[i] > self.starts[i + 1]]
+
+    def repair_overlaps(self, gap=0):
+        """Ends each overlapping cue gap ms before the next cue starts, but
+        never before it starts itself.
+        """
+        if len(self.starts) < 2:
+            return self
+
+        if numpy is not None:
+            overlapping = self.ends[:-1] > self.starts[1:]
+            latest_ends = numpy.maximum(self.starts[1:] - gap, self.starts[:-1])
+            self.ends[:-1] = numpy.where(overlapping,
+                numpy.minimum(self.ends[:-1], latest_ends), self.ends[:-1])
+        else:
+            for i in self.find_overlaps():
+                self.ends[i] = max(min(self.ends[i], self.starts[i + 1] - gap),
+                    self.starts[i])
+        return self
+
 
 class TranscriptReader(object):
-    """Returns subtitle entries stored in either a .sub file or a .pot file."""
+    """Returns subtitle entries stored in either a .sub file or a .pot file.
+
+    Subclasses parse their content into self.cues, a list of Cue objects
+    sorted by (start, end).
+    """
     # 0:00:01.389,0:00:06.839
-    REGEX_TIMESTAMP = '((?P<start_time>\d:\d\d:\d\d(\.\d\d\d)?),(?P<end_time>\d:\d\d:\d\d(\.\d\d\d)?))'
+    REGEX_TIMESTAMP = '((?P<start_time>\d+:\d\d:\d\d(\.\d\d\d)?),(?P<end_time>\d+:\d\d:\d\d(\.\d\d\d)?))'
+
+    def _set_cues(self, cues):
+        """Stores cues in time order.
+
+        Cues normally arrive in order already, so this only sorts when an
+        out-of-order cue is found.  A cue with the same timing as an earlier
+        one replaces it, as it did when entries were keyed by timestamp.
+        """
+        ordered = []
+        last_key = None
+
+        for cue in cues:
+            key = (cue.start, cue.end)
+            if last_key is not None and key <= last_key:
+                if key == last_key:
+                    ordered[-1] = cue
+                    continue
+
+                by_timing = dict(((c.start, c.end), c) for c in cues)
+                ordered = [by_timing[k] for k in sorted(by_timing)]
+                break
+
+            ordered.append(cue)
+            last_key = key
+
+        self.cues = ordered
+        self._interval_index = None
+
+    def _make_cue(self, timestamp_match, text):
+        return Cue(timestamp_to_ms(timestamp_match.group('start_time')),
+            timestamp_to_ms(timestamp_match.group('end_time')), text)
+
+    def _parse_timing_line(self, line):
+        """Returns (start, end) ms for a line holding a timing, like
+        '0:00:01.389,0:00:06.839' or '#: 0:00:01.389,0:00:06.839', or None.
+        """
+        timing = parse_timing(line.lstrip('#: '))
+        if timing:
+            return timing
+
+        timestamp_match = re.search(self.REGEX_TIMESTAMP, line)
+        if timestamp_match:
+            return (timestamp_to_ms(timestamp_match.group('start_time')),
+                timestamp_to_ms(timestamp_match.group('end_time')))
+        return None
+
+    def iter_cues(self):
+        """Yields each Cue in time order."""
+        return iter(self.cues)
+
+    def get_cue(self, index):
+        """Returns the index'th Cue, in time order."""
+        return self.cues[index]
+
+    def get_interval_index(self):
+        """Returns a CueIntervalIndex over the cues, built on first use."""
+        if getattr(self, '_interval_index', None) is None:
+            self._interval_index = CueIntervalIndex.from_cues(self.cues)
+        return self._interval_index
+
+    def cues_at(self, ms):
+        """Returns the cues showing at ms, those with start <= ms < end."""
+        return [self.get_cue(i) for i in self.get_interval_index().at(ms)]
+
+    def cues_overlapping(self, start, end):
+        """Returns the cues which overlap the time range [start, end)."""
+        return [self.get_cue(i)
+            for i in self.get_interval_index().overlapping(start, end)]
+
+    def get_timings(self):
+        """Returns a CueTimings with a copy of every cue's timing."""
+        return CueTimings.from_cues(self.cues)
+
+    def set_timings(self, timings):
+        """Writes timings, from get_timings(), back into the cues.
+
+        The cues are put back in time order, and of any which now share a
+        timing, only the last is kept, as when a transcript is read.
+        """
+        if len(timings) != len(self.cues):
+            raise ValueError('Timings do not match the number of cues')
+
+        for cue, start, end in zip(self.cues, timings.starts, timings.ends):
+            cue.start = int(start)
+            cue.end = int(end)
+
+        # Also resets the interval index
+        self._set_cues(self.cues)
+
+    @property
+    def entries(self):
+        """A dict like {'0:00:01.389,0:00:06.839': text}"""
+        return dict((cue.timestamp, cue.text) for cue in self.iter_cues())
 
     def list_entries(self):
-        # Sort dictionary entries by their keys
-        keys = self.entries.keys()
-        keys.sort()
+        """Returns a list of (timestamp, text) tuples in time order."""
+        return [(cue.timestamp, cue.text) for cue in self.iter_cues()]
+
+    def fingerprint(self):
+        """Returns a hash of the transcript in a canonical form.
 
-        # TODO(mattfaus): Create named tuples for more readable code?
-        return [(k, self.entries[k]) for k in keys]
+        Only the timing and the words of each cue are hashed, so the same
+        transcript has the same fingerprint whatever format it was read from
+        and however its lines are wrapped or spaced.
+        """
+        digest = hashlib.sha1()
+        for cue in self.iter_cues():
+            _update_fingerprint(digest, cue.start, cue.end, cue.text)
+        return digest.hexdigest()
 
 
 class SubTranscriptReader(TranscriptReader):
@@ -23,38 +506,32 @@ class SubTranscriptReader(TranscriptReader):
         self._build_entries()
 
     def _build_entries(self):
-        timestamp_regex = re.compile(self.REGEX_TIMESTAMP)
+        cues = []
 
-        self.entries = {}
-
-        cur_timestamp = None
-        cur_string = ""
+        cur_timing = None
+        cur_lines = []
 
         for line in self.content.splitlines():
-            timestamp_match = timestamp_regex.search(line)
-
-            if cur_timestamp:
+            if cur_timing:
                 if not line:  # Entries are seperated by a blank lin
-                    # Remove the last newline
-                    cur_string = cur_string[:-1]
-                    self.entries[cur_timestamp] = cur_string
-                    cur_timestamp = None
-                    cur_string = ""
+                    cues.append(Cue(cur_timing[0], cur_timing[1], '\n'.join(cur_lines)))
+                    cur_timing = None
+                    cur_lines = []
                 else:
-                    cur_string += line + '\n'
+                    cur_lines.append(line)
             else:
                 if not line:
                     # Extra whitespace / end of file?
                     pass
-                elif timestamp_match:
-                    cur_timestamp = line
                 else:
-                    raise ValueError('Format not understood')
+                    cur_timing = self._parse_timing_line(line)
+                    if not cur_timing:
+                        raise ValueError('Format not understood')
 
-        if cur_timestamp and cur_string:
-            self.entries[cur_timestamp] = cur_string[:-1]
-            cur_timestamp = None
-            cur_string = ""
+        if cur_timing and cur_lines:
+            cues.append(Cue(cur_timing[0], cur_timing[1], '\n'.join(cur_lines)))
+
+        self._set_cues(cues)
 
 
 class PotTranscriptReader(TranscriptReader):
@@ -62,37 +539,99 @@ class PotTranscriptReader(TranscriptReader):
     MSGID_BREAKER = 'msgid "'
     MSGSTR_BREAKER = 'msgstr "'
 
-    def __init__(self, content):
+    # A whole entry: the line holding the timestamp, the lines up to the
+    # msgstr, then the msgstr and its continuation lines.  Matches the same
+    # entries the line-by-line parser finds in well-formed .po files, where
+    # the msgstr comes before the blank line which ends its entry.  The
+    # search for the msgstr stops at that blank line, otherwise a timestamp
+    # without a msgstr would be searched to the end of the file.
+    #
+    # The timestamps are REGEX_TIMESTAMP split into the 'H:MM', ':SS' and
+    # '.mmm' pieces which _CLOCK_MS, _SECONDS_MS and _MILLIS_MS are keyed
+    # on.  The msgstr group runs from inside the first quote to inside the
+    # last, so continuation lines are joined by replacing each '"\n"'.
+    REGEX_ENTRY = re.compile(
+        r'^.*?'
+        r'(\d+:\d\d)(:\d\d)(\.\d\d\d)?,(\d+:\d\d)(:\d\d)(\.\d\d\d)?'
+        r'.*\n'
+        r'(?:.+\n)*?'
+        r'msgstr "(.*(?:"\n".*)*)"$',
+        re.MULTILINE)
+
+    def __init__(self, content, use_regex=True):
+        """
+        Arguments:
+            content - the .po file contents
+            use_regex - when True, tokenize the whole buffer with a single
+                REGEX_ENTRY pass instead of walking it line by line
+        """
         self.content = content
-        self._build_entries()
+        if use_regex:
+            self._build_entries_by_regex()
+        else:
+            self._build_entries()
 
-    def _build_entries(self):
-        timestamp_regex = re.compile(self.REGEX_TIMESTAMP)
+    @classmethod
+    def find_cues(cls, content):
+        """Returns a Cue for each entry found in .po content, in file order."""
+        cues = []
+
+        # findall() builds every match's groups in one call, which is
+        # faster than a match object per entry
+        for (start_clock, start_seconds, start_millis, end_clock, end_seconds,
+                end_millis, text) in cls.REGEX_ENTRY.findall(
+                _normalize_po_line_breaks(content)):
+            try:
+                start = (_CLOCK_MS[start_clock] + _SECONDS_MS[start_seconds]
+                    + _MILLIS_MS[start_millis])
+                end = (_CLOCK_MS[end_clock] + _SECONDS_MS[end_seconds]
+                    + _MILLIS_MS[end_millis])
+            except KeyError:
+                # An hour and minute not seen yet, or an irregular timestamp
+                start = timestamp_to_ms(start_clock + start_seconds + start_millis)
+                end = timestamp_to_ms(end_clock + end_seconds + end_millis)
+
+            if '\n' in text:
+                text = text.replace('"\n"', '\n')
+            if '\\' in text:
+                text = unescape_po_string(text)
+            cues.append(Cue(start, end, text))
+
+        return cues
+
+    def _build_entries_by_regex(self):
+        self._set_cues(self.find_cues(self.content))
 
-        self.entries = {}
+    @staticmethod
+    def _make_line_cue(timing, string):
+        text = string[:-1]  # remove last \n
+        if '\\' in text:
+            text = unescape_po_string(text)
+        return Cue(timing[0], timing[1], text)
 
-        cur_timestamp = None
+    def _build_entries(self):
+        cues = []
+
+        cur_timing = None
         cur_id = ""
         cur_string = ""
 
-        # TODO(mattfaus): Try to do this with a regex instead?
+        # See _build_entries_by_regex() for the single-pass version of this
         # http://stackoverflow.com/questions/8433686/is-there-a-php-library-for-parsing-gettext-po-pot-files
-        # #: ((?P<start_time>\d:\d\d:\d\d(\.\d\d\d)?),(?P<end_time>\d:\d\d:\d\d(\.\d\d\d)?)).*\n.*msgid\s+("(.*)"\s+)+msgstr
 
-        for line in self.content.splitlines():
-            if not line and cur_timestamp and cur_string:
+        # Lines are split as find_cues() sees them, at '\n' only
+        for line in _normalize_po_line_breaks(self.content).split('\n'):
+            if not line and cur_timing and cur_string:
                 # We found one, so add it and continue
-                self.entries[cur_timestamp] = cur_string[:-1]  # remove last \n
-                cur_timestamp = None
+                cues.append(self._make_line_cue(cur_timing, cur_string))
+                cur_timing = None
                 cur_id = ""
                 cur_string = ""
                 continue
 
-            if not cur_timestamp:
+            if not cur_timing:
                 # We're looking for the next timestamp
-                timestamp_match = timestamp_regex.search(line)
-                if timestamp_match:
-                    cur_timestamp = timestamp_match.groups()[0]
+                cur_timing = self._parse_timing_line(line)
             else:
                 if not cur_id:
                     # We're looking for the next msgid
@@ -109,24 +648,399 @@ class PotTranscriptReader(TranscriptReader):
                     # We're building cur_string
                     cur_string += line[1:-1] + '\n'
 
-        if cur_timestamp and cur_string:
+        if cur_timing and cur_string:
             # We found one, so add it and continue
-            self.entries[cur_timestamp] = cur_string[:-1]  # remove last \n
+            cues.append(self._make_line_cue(cur_timing, cur_string))
+
+        self._set_cues(cues)
+
+
+class MappedSubTranscriptReader(TranscriptReader):
+    """Reads a .sub file through mmap without loading its text into memory.
+
+    The first scan only records the timing and the byte offsets of each
+    cue's text in compact arrays.  Text is read from the map and decoded as
+    cues are iterated or looked up, so memory use does not grow with the
+    size of the text.
+    """
+    # A timing line and the non-blank lines after it, which are the text
+    REGEX_CUE = re.compile(
+        r'^[^\r\n]*?' + TranscriptReader.REGEX_TIMESTAMP + r'[^\r\n]*(?:\r\n|\r|\n|\Z)'
+        r'(?P<text>(?:[^\r\n]+(?:\r\n|\r|\n|\Z))*)',
+        re.MULTILINE)
+
+    def __init__(self, source, encoding='utf-8'):
+        """
+        Arguments:
+            source - the path to a .sub file, or an mmap of one
+            encoding - used to decode the text of each cue
+        """
+        self.encoding = encoding
+        self._file = None
+
+        if isinstance(source, mmap.mmap):
+            self._map = source
+        else:
+            self._file = open(source, 'rb')
+            if os.fstat(self._file.fileno()).st_size:
+                self._map = mmap.mmap(self._file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+            else:
+                # An empty file cannot be mapped
+                self._map = ''
+
+        self._build_index()
+
+    def _build_index(self):
+        starts = array.array('l')
+        ends = array.array('l')
+        offsets = array.array('l')
+        lengths = array.array('l')
+
+        last_end = 0
+        for match in self.REGEX_CUE.finditer(self._map):
+            if self._map[last_end:match.start()].strip():
+                raise ValueError('Format not understood')
+            last_end = match.end()
+
+            if last_end == len(self._map) and not match.group('text'):
+                # A timing line at the end of the file with no text, which
+                # SubTranscriptReader also drops
+                continue
+
+            starts.append(timestamp_to_ms(match.group('start_time')))
+            ends.append(timestamp_to_ms(match.group('end_time')))
+            offsets.append(match.start('text'))
+            lengths.append(match.end('text') - match.start('text'))
+
+        if self._map[last_end:].strip():
+            raise ValueError('Format not understood')
+
+        # Put the index in time order, the same way _set_cues() orders cues
+        in_order = all((starts[i - 1], ends[i - 1]) < (starts[i], ends[i])
+            for i in xrange(1, len(starts)))
+
+        if not in_order:
+            by_timing = {}
+            for i in xrange(len(starts)):
+                by_timing[(starts[i], ends[i])] = i
+            order = [by_timing[key] for key in sorted(by_timing)]
+
+            starts = array.array('l', (starts[i] for i in order))
+            ends = array.array('l', (ends[i] for i in order))
+            offsets = array.array('l', (offsets[i] for i in order))
+            lengths = array.array('l', (lengths[i] for i in order))
+
+        self._starts = starts
+        self._ends = ends
+        self._offsets = offsets
+        self._lengths = lengths
+        self._interval_index = CueIntervalIndex(starts, ends)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def get_cue(self, index):
+        """Returns the index'th Cue, in time order."""
+        offset = self._offsets[index]
+        text = self._map[offset:offset + self._lengths[index]]
+        text = '\n'.join(text.splitlines()).decode(self.encoding)
+        return Cue(self._starts[index], self._ends[index], text)
+
+    def iter_cues(self):
+        for index in xrange(len(self._starts)):
+            yield self.get_cue(index)
+
+    @property
+    def cues(self):
+        """All cues, loaded into memory.  Prefer iter_cues()."""
+        return list(self.iter_cues())
+
+    def get_timings(self):
+        return CueTimings(self._starts, self._ends)
+
+    def set_timings(self, timings):
+        raise TypeError('%s is read-only, copy its cues into another reader '
+            'to change their timings' % self.__class__.__name__)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        if self._file:
+            self._file.close()
+
+
+class GettextTranscriptReader(TranscriptReader):
+    """Reads .po files with the same tokenizer as iter_po_entries(), but
+    only decodes the strings a cue needs.
+
+    The timing of each entry comes from its msgctxt, as written by
+    PoCatalogWriter, or else from its '#:' reference, as written by
+    PotTranscriptWriter.  Files without any msgctxt are assumed to come
+    from PotTranscriptWriter, whose separate literals are separate lines.
+
+    The header, obsolete and plural entries, and entries without a timing
+    are skipped.  Untranslated entries use their msgid.
+    """
+
+    def __init__(self, content, skip_fuzzy=False):
+        """
+        Arguments:
+            content - the .po file contents
+            skip_fuzzy - if True, leave out entries flagged as fuzzy
+        """
+        self.content = content
+        self.skip_fuzzy = skip_fuzzy
+        self._build_entries()
+
+    @staticmethod
+    def _get_comments_timing(comments):
+        """Returns the timing of the first '#:' reference which has one."""
+        for line in comments.splitlines():
+            line = line.strip()
+            if line.startswith('#:'):
+                for reference in line[2:].split():
+                    timing = parse_timing(reference)
+                    if timing:
+                        return timing
+        return None
+
+    def _build_entries(self):
+        content = _normalize_po_line_breaks(self.content)
+        has_context = content.startswith('msgctxt ') or '\nmsgctxt ' in content
+        literal_separator = '' if has_context else '\n'
+
+        cues = _find_po_cues(content, literal_separator)
+        if cues is not None:
+            self._set_cues(cues)
+            return
+
+        cues = []
+        for match in REGEX_PO_ENTRY.finditer(content):
+            (comments, reference, msgctxt, msgctxt_more, msgid, msgid_more,
+                msgstr, msgstr_more, _, _, _, _, junk) = match.groups()
+
+            if msgstr is None:
+                if junk is not None:
+                    raise ValueError('Format not understood: %r' % junk)
+                # An obsolete or plural entry
+                continue
+
+            if self.skip_fuzzy and comments:
+                entry = PoEntry()
+                _parse_po_comments(entry, comments)
+                if entry.fuzzy:
+                    continue
+
+            timing = None
+            if msgctxt is not None:
+                # A timing has no escapes, so it only needs joining if split
+                if msgctxt_more:
+                    msgctxt = _parse_po_string(msgctxt, msgctxt_more,
+                        literal_separator)
+                timing = parse_timing(msgctxt)
+            elif reference:
+                timing = parse_timing(reference)
+            if not timing and comments:
+                timing = self._get_comments_timing(comments)
+            if not timing:
+                continue
+
+            # Most msgstrs are a single literal without escapes
+            if msgstr_more or '\\' in msgstr:
+                text = _parse_po_string(msgstr, msgstr_more, literal_separator)
+            else:
+                text = msgstr
+            if not text:
+                text = _parse_po_string(msgid, msgid_more, literal_separator)
+            cues.append(Cue(timing[0], timing[1], text))
+
+        self._set_cues(cues)
+
+
+def read_po_transcript(content):
+    """Reads a .po transcript with GettextTranscriptReader, or with
+    PotTranscriptReader if it is not a valid catalog, like the files older
+    versions of PotTranscriptWriter wrote without escaping quotes.
+    """
+    try:
+        return GettextTranscriptReader(content)
+    except ValueError:
+        return PotTranscriptReader(content)
+
+
+class CueBlockTranscriptReader(TranscriptReader):
+    """Reads formats where each cue is a block of lines, separated by blank
+    lines, with a 'start --> end' timing line.  Lines before the timing line
+    (SRT indexes, WebVTT identifiers) and blocks without one (WebVTT headers
+    and NOTE blocks) are skipped.
+    """
+    REGEX_TIMING = None
+
+    def __init__(self, content):
+        self.content = content
+        self._build_entries()
+
+    def _build_entries(self):
+        cues = []
+
+        cur_timing = None
+        cur_lines = []
+
+        for line in self.content.lstrip(u'\ufeff').splitlines():
+            if cur_timing:
+                if not line.strip():
+                    cues.append(self._make_cue(cur_timing, '\n'.join(cur_lines)))
+                    cur_timing = None
+                    cur_lines = []
+                else:
+                    cur_lines.append(line)
+            elif line.strip():
+                cur_timing = self.REGEX_TIMING.match(line.strip())
+
+        if cur_timing:
+            cues.append(self._make_cue(cur_timing, '\n'.join(cur_lines)))
+
+        self._set_cues(cues)
+
+
+class SrtTranscriptReader(CueBlockTranscriptReader):
+    # 00:00:00,504 --> 00:00:05,270
+    REGEX_TIMING = re.compile(
+        r'(?P<start_time>\d+:\d\d:\d\d[,.]\d\d\d)\s*-->\s*'
+        r'(?P<end_time>\d+:\d\d:\d\d[,.]\d\d\d)')
+
+
+class VttTranscriptReader(CueBlockTranscriptReader):
+    # 00:00:00.504 --> 00:00:05.270 align:start, hours are optional
+    REGEX_TIMING = re.compile(
+        r'(?P<start_time>(?:\d+:)?\d\d:\d\d\.\d\d\d)\s+-->\s+'
+        r'(?P<end_time>(?:\d+:)?\d\d:\d\d\.\d\d\d)')
+
+
+class AmaraJsonTranscriptReader(TranscriptReader):
+    """Reads the subtitle files written by tools/amara_exporter.py.
+
+    These are either a list of {"start": ms, "end": ms, "text": ...} dicts,
+    or an Amara API response which holds that list under "subtitles".  If
+    the response holds subtitles in another format, named by "sub_format",
+    they are parsed with that format's reader.
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self._build_entries()
+
+    def _build_entries(self):
+        data = json.loads(self.content)
+
+        if isinstance(data, dict):
+            subtitles = data.get('subtitles', [])
+            if isinstance(subtitles, basestring):
+                reader = read_transcript(subtitles, data.get('sub_format', 'srt'))
+                self._set_cues(reader.cues)
+                return
+        else:
+            subtitles = data
+
+        cues = []
+        for subtitle in subtitles:
+            start = subtitle.get('start')
+            end = subtitle.get('end')
+
+            # Unsynced subtitles have no (or negative) timing
+            if start is None or end is None or start < 0 or end < 0:
+                continue
+
+            cues.append(Cue(int(start), int(end), subtitle.get('text', '')))
+
+        self._set_cues(cues)
+
+
+class TranscriptStream(object):
+    """A read-only file-like object over a sequence of text chunks.
+
+    Chunks are pulled and encoded only as they are read, so the whole
+    transcript is never held in memory unless read() is called without a size.
+    """
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self._chunks = iter(chunks)
+        self._encoding = encoding
+        self._buffer = ''
+
+    def _next_chunk(self):
+        chunk = next(self._chunks, None)
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode(self._encoding)
+        return chunk
+
+    def read(self, size=-1):
+        pieces = [self._buffer]
+        length = len(self._buffer)
+
+        while size is None or size < 0 or length < size:
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+            pieces.append(chunk)
+            length += len(chunk)
+
+        data = ''.join(pieces)
+        if size is None or size < 0:
+            self._buffer = ''
+            return data
+
+        self._buffer = data[size:]
+        return data[:size]
+
+    def close(self):
+        self._chunks = iter(())
+        self._buffer = ''
 
 
 class TranscriptWriter(object):
+    """Formats the cues of a TranscriptReader.
+
+    Output is produced one entry at a time by iter_entries(), so it can be
+    written out or uploaded without building the whole file in memory.
+    """
+    ENTRY_FORMAT = None
+
     def __init__(self, reader):
         if not isinstance(reader, TranscriptReader):
             raise ValueError('Must pass a TranscriptReader')
 
         self.reader = reader
 
-    def get_file(self):
-        """Returns a file-like object with the contents of the transcript."""
-        return cStringIO.StringIO(self.content)
+    def _format_entry(self, cue):
+        raise NotImplementedError()
+
+    def iter_entries(self):
+        """Yields the formatted text of each entry, in time order."""
+        for cue in self.reader.iter_cues():
+            yield self._format_entry(cue)
+
+    def write_to(self, fileobj, encoding='utf-8'):
+        """Writes the transcript into fileobj one entry at a time."""
+        for entry in self.iter_entries():
+            if isinstance(entry, unicode):
+                entry = entry.encode(encoding)
+            fileobj.write(entry)
+
+    @property
+    def content(self):
+        """The whole transcript as a single string.
+
+        This is built on every access, prefer iter_entries() or write_to().
+        """
+        return ''.join(self.iter_entries())
 
     def get_file(self):
-        return cStringIO.StringIO(self.content)
+        """Returns a file-like object with the utf-8 encoded contents of the
+        transcript, which are generated as it is read.
+        """
+        return TranscriptStream(self.iter_entries())
 
 
 class PotTranscriptWriter(TranscriptWriter):
@@ -138,21 +1052,19 @@ msgstr \"%(text)s\"
 
 """)
 
-    def __init__(self, reader):
-        super(PotTranscriptWriter, self).__init__(reader)
-        self._build_pot_file()
-
-    def _format_line(self, line):
-        return line.replace('\n', "\"\n\"")
-
-    def _build_pot_file(self):
-        self.content = ""
+    def _format_line(self, text):
+        # Each line of text is a separate literal, escaped so the file can
+        # be read back by GettextTranscriptReader
+        if REGEX_PO_ESCAPE.search(text):
+            text = '"\n"'.join(escape_po_string(line)
+                for line in text.split('\n'))
+        return text
 
-        for entry in self.reader.list_entries():
-            self.content += self.ENTRY_FORMAT % {
-                'timestamp': entry[0],
-                'text': self._format_line(entry[1]),
-            }
+    def _format_entry(self, cue):
+        return self.ENTRY_FORMAT % {
+            'timestamp': cue.timestamp,
+            'text': self._format_line(cue.text),
+        }
 
 
 class SubTranscriptWriter(TranscriptWriter):
@@ -163,16 +1075,698 @@ class SubTranscriptWriter(TranscriptWriter):
 
 """)
 
-    def __init__(self, reader):
-        super(SubTranscriptWriter, self).__init__(reader)
-        self._build_sub_file()
+    def _format_entry(self, cue):
+        return self.ENTRY_FORMAT % {
+            'timestamp': cue.timestamp,
+            'text': cue.text,
+        }
+
+
+class SrtTranscriptWriter(TranscriptWriter):
+
+    ENTRY_FORMAT = (
+"""%(index)d
+%(start)s --> %(end)s
+%(text)s
+
+""")
+
+    TIMESTAMP_FORMAT = '%02d:%02d:%02d,%03d'
+
+    def iter_entries(self):
+        for index, cue in enumerate(self.reader.iter_cues(), 1):
+            yield self._format_entry(cue, index)
+
+    def _format_entry(self, cue, index=1):
+        """
+        Arguments:
+            index - the cue's 1-based position in the transcript
+        """
+        return self.ENTRY_FORMAT % {
+            'index': index,
+            'start': ms_to_timestamp(cue.start, self.TIMESTAMP_FORMAT),
+            'end': ms_to_timestamp(cue.end, self.TIMESTAMP_FORMAT),
+            'text': cue.text,
+        }
+
+
+class VttTranscriptWriter(TranscriptWriter):
+
+    HEADER = 'WEBVTT\n\n'
+
+    ENTRY_FORMAT = (
+"""%(start)s --> %(end)s
+%(text)s
+
+""")
+
+    TIMESTAMP_FORMAT = '%02d:%02d:%02d.%03d'
+
+    def iter_entries(self):
+        yield self.HEADER
+        for entry in super(VttTranscriptWriter, self).iter_entries():
+            yield entry
+
+    def _format_entry(self, cue):
+        return self.ENTRY_FORMAT % {
+            'start': ms_to_timestamp(cue.start, self.TIMESTAMP_FORMAT),
+            'end': ms_to_timestamp(cue.end, self.TIMESTAMP_FORMAT),
+            'text': cue.text,
+        }
+
+
+class AmaraJsonTranscriptWriter(TranscriptWriter):
+    """Writes a list of {"start": ms, "end": ms, "text": ...} dicts."""
+
+    def iter_entries(self):
+        separator = '[\n'
+        for cue in self.reader.iter_cues():
+            yield separator + self._format_entry(cue)
+            separator = ',\n'
+
+        yield '[]\n' if separator == '[\n' else '\n]\n'
+
+    def _format_entry(self, cue):
+        return json.dumps({
+            'start': cue.start,
+            'end': cue.end,
+            'text': cue.text,
+        }, sort_keys=True)
+
+
+class PoEntry(object):
+    """A single entry of a gettext catalog.
+
+    Attributes:
+        msgctxt - the context, or None
+        msgid - the source string
+        msgid_plural - the plural source string, or None
+        msgstr - the translation, when there is no msgid_plural
+        msgstr_plural - the list of plural translations, msgstr[0], ...
+        flags - like ['fuzzy'], from '#,' comments
+        comments - translator comments, from '# ' comments
+        extracted_comments - from '#.' comments
+        references - from '#:' comments
+        obsolete - True for '#~' entries
+    """
+    __slots__ = ('msgctxt', 'msgid', 'msgid_plural', 'msgstr', 'msgstr_plural',
+        'flags', 'comments', 'extracted_comments', 'references', 'obsolete')
+
+    def __init__(self, msgid='', msgstr='', msgctxt=None, msgid_plural=None,
+        msgstr_plural=None, flags=None, comments=None, extracted_comments=None,
+        references=None, obsolete=False):
+        self.msgctxt = msgctxt
+        self.msgid = msgid
+        self.msgid_plural = msgid_plural
+        self.msgstr = msgstr
+        self.msgstr_plural = msgstr_plural or []
+        self.flags = flags or []
+        self.comments = comments or []
+        self.extracted_comments = extracted_comments or []
+        self.references = references or []
+        self.obsolete = obsolete
+
+    @property
+    def fuzzy(self):
+        return 'fuzzy' in self.flags
+
+    def __repr__(self):
+        return 'PoEntry(msgctxt=%r, msgid=%r, msgstr=%r)' % (
+            self.msgctxt, self.msgid, self.msgstr)
+
+
+# Characters which must be escaped inside a gettext string literal
+PO_ESCAPES = {
+    '\\': '\\\\',
+    '"': '\\"',
+    '\n': '\\n',
+    '\r': '\\r',
+    '\t': '\\t',
+}
+
+REGEX_PO_ESCAPE = re.compile(r'[\\"\n\r\t]')
+
+
+def escape_po_string(text):
+    """Escapes text to go between the quotes of a gettext string literal."""
+    return REGEX_PO_ESCAPE.sub(lambda match: PO_ESCAPES[match.group(0)], text)
+
+
+def _format_po_string(keyword, text, prefix):
+    """Formats a keyword and its string, like 'msgid "text"'.  Text with
+    line breaks is split into one literal per line, after an empty one.
+    """
+    lines = text.splitlines(True)
+    if len(lines) <= 1:
+        return '%s%s "%s"\n' % (prefix, keyword, escape_po_string(text))
+
+    pieces = ['%s%s ""\n' % (prefix, keyword)]
+    for line in lines:
+        pieces.append('%s"%s"\n' % (prefix, escape_po_string(line)))
+    return ''.join(pieces)
+
+
+def format_po_entry(entry):
+    """Formats a PoEntry, followed by a blank line."""
+    pieces = []
+
+    for comment in entry.comments:
+        pieces.append('# %s\n' % comment)
+    for comment in entry.extracted_comments:
+        pieces.append('#. %s\n' % comment)
+    for reference in entry.references:
+        pieces.append('#: %s\n' % reference)
+    if entry.flags:
+        pieces.append('#, %s\n' % ', '.join(entry.flags))
+
+    prefix = '#~ ' if entry.obsolete else ''
+
+    if entry.msgctxt is not None:
+        pieces.append(_format_po_string('msgctxt', entry.msgctxt, prefix))
+    pieces.append(_format_po_string('msgid', entry.msgid, prefix))
+
+    if entry.msgid_plural is not None:
+        pieces.append(_format_po_string('msgid_plural', entry.msgid_plural, prefix))
+        for index, msgstr in enumerate(entry.msgstr_plural):
+            pieces.append(_format_po_string('msgstr[%i]' % index, msgstr, prefix))
+    else:
+        pieces.append(_format_po_string('msgstr', entry.msgstr, prefix))
+
+    pieces.append('\n')
+    return ''.join(pieces)
+
+
+PO_UNESCAPES = {
+    'n': '\n',
+    't': '\t',
+    'r': '\r',
+    'a': '\a',
+    'b': '\b',
+    'f': '\f',
+    'v': '\v',
+}
+
+REGEX_PO_UNESCAPE = re.compile(r'\\(?:([0-7]{1,3})|x([0-9a-fA-F]{1,2})|(.))',
+    re.DOTALL)
+
+
+def _unescape_po_match(match):
+    octal, hexadecimal, char = match.groups()
+    if char is not None:
+        return PO_UNESCAPES.get(char, char)
+
+    value = int(octal, 8) if octal else int(hexadecimal, 16)
+    return unichr(value) if isinstance(match.string, unicode) else chr(value)
+
+
+def unescape_po_string(text):
+    """Reverses escape_po_string(), also handling octal and hex escapes."""
+    if '\\' not in text:
+        return text
+
+    # Usually the only escapes are line breaks
+    if text.count('\\') == text.count('\\n'):
+        return text.replace('\\n', '\n')
+    return REGEX_PO_UNESCAPE.sub(_unescape_po_match, text)
+
+
+# A single string literal on its own line
+_PO_LITERAL = r'[ \t]*"[^"\\\n]*(?:\\.[^"\\\n]*)*"[ \t]*(?:\n|\Z)'
+
+
+def _po_string_pattern(name):
+    # The first literal's contents are captured on their own, and any more
+    # literals in name_more, so the usual single literal needs no parsing
+    return (r'"(?P<%s>[^"\\\n]*(?:\\.[^"\\\n]*)*)"[ \t]*(?:\n|\Z)'
+        r'(?P<%s_more>(?:%s)*)' % (name, name, _PO_LITERAL))
+
+
+# A whole entry: its comments, then either its keywords and strings, or the
+# '#~' lines of an obsolete entry.  A line which is neither, nor blank, nor
+# a comment, is matched as junk so it can be reported.  If the first comment
+# is a single reference, like the timings we write, it is also captured.
+REGEX_PO_ENTRY = re.compile(r'''
+    (?P<comments>
+        (?:^[ \t]*\#:[ \t]*(?P<reference>\S+)[ \t]*\n)?
+        (?:^[ \t]*\#(?!~).*\n)*)
+    (?:
+        (?:^[ \t]*msgctxt[ \t]+%(msgctxt)s)?
+        ^[ \t]*msgid[ \t]+%(msgid)s
+        (?:
+            ^[ \t]*msgstr[ \t]+%(msgstr)s
+        |
+            ^[ \t]*msgid_plural[ \t]+%(msgid_plural)s
+            (?P<msgstr_plural>
+                (?:^[ \t]*msgstr\[\d+\][ \t]+(?:%(literal)s)+)+)
+        )
+    |
+        (?P<obsolete>(?:^[ \t]*\#~.*(?:\n|\Z))+)
+    |
+        ^[ \t]*(?P<junk>[^\s\#].*)
+    )''' % {
+        'msgctxt': _po_string_pattern('msgctxt'),
+        'msgid': _po_string_pattern('msgid'),
+        'msgstr': _po_string_pattern('msgstr'),
+        'msgid_plural': _po_string_pattern('msgid_plural'),
+        'literal': _PO_LITERAL,
+    }, re.MULTILINE | re.VERBOSE)
+
+# An entry as PoCatalogWriter or PotTranscriptWriter write them, after any
+# blank lines: an optional timing reference and single literal msgctxt, then
+# the msgid and msgstr, whose literals are captured together, still joined
+# by '"\n"'.  Any other line is captured on its own.  This is a shortcut for
+# GettextTranscriptReader, see _find_po_cues().
+REGEX_PO_CUE = re.compile(r'''
+    \n*
+    (?:
+        (?:\#:[ ](\S+)\n|)
+        (?:msgctxt[ ]"([^"\\\n]*)"\n|)
+        msgid[ ]"(.*(?:"\n".*)*)"[ \t]*\n
+        msgstr[ ]"(.*(?:"\n".*)*)"[ \t]*(?:\n|\Z)
+    |
+        (.+)
+    )''', re.VERBOSE)
+
+# The contents of one or more valid literals, joined by '"\n"'
+REGEX_PO_LITERALS = re.compile(
+    r'[^"\\\n]*(?:\\.[^"\\\n]*)*(?:"\n"[^"\\\n]*(?:\\.[^"\\\n]*)*)*\Z')
+
+REGEX_PO_LITERAL = re.compile(r'"([^"\\\n]*(?:\\.[^"\\\n]*)*)"')
+
+REGEX_PO_MSGSTR_PLURAL = re.compile(
+    r'msgstr\[(?P<index>\d+)\][ \t]+(?P<strings>(?:%s)+)' % _PO_LITERAL)
+
+REGEX_PO_OBSOLETE_PREFIX = re.compile(r'^[ \t]*#~[ \t]?', re.MULTILINE)
+
+
+def _parse_po_string(first, more, literal_separator):
+    if more:
+        first = literal_separator.join(
+            [first] + REGEX_PO_LITERAL.findall(more))
+    if '\\' in first:
+        return unescape_po_string(first)
+    return first
+
+
+def _parse_po_comments(entry, comments):
+    if comments.startswith('#: ') and comments.count('\n') == 1:
+        # Just a reference, the usual case for transcripts
+        entry.references.extend(comments[3:].split())
+        return
+
+    for line in comments.splitlines():
+        line = line.strip()
+        kind = line[1:2]
+        if kind == ':':
+            entry.references.extend(line[2:].split())
+        elif kind == ',':
+            entry.flags.extend(
+                flag.strip() for flag in line[2:].split(',') if flag.strip())
+        elif kind == '.':
+            entry.extracted_comments.append(line[2:].strip())
+        elif kind == '|':
+            # Previous strings, used by msgmerge
+            pass
+        else:
+            entry.comments.append(line[1:].strip())
+
+
+def _normalize_po_line_breaks(content):
+    if '\r' in content:
+        # Only '\n' ends a line for the regexes.  Other characters which
+        # splitlines() would break at are part of the text, as for gettext.
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
+
+
+def _join_po_literals(literals, literal_separator):
+    """Joins the literals captured by REGEX_PO_CUE, without unescaping.
+
+    Returns:
+        None if any literal has an unescaped quote or ends with an escape.
+    """
+    text = literals
+    if '\n' in text:
+        text = text.replace('"\n"', literal_separator)
+    if ('"' in text or text.endswith('\\') or '\\"\n' in literals) and (
+            not REGEX_PO_LITERALS.match(literals)):
+        return None
+    return text
+
+
+def _find_po_cues(content, literal_separator):
+    """Reads the cues of a catalog with a single REGEX_PO_CUE pass, as
+    GettextTranscriptReader would, in file order.
+
+    Returns:
+        None if any line is not part of an entry as our writers write
+        them, in which case the file needs the full tokenizer.
+    """
+    cues = []
+
+    for reference, msgctxt, msgid, msgstr, other in REGEX_PO_CUE.findall(
+            content):
+        if other:
+            return None
+
+        text = _join_po_literals(msgstr, literal_separator)
+        if text is None:
+            return None
+        if msgid != msgstr or not text:
+            msgid = _join_po_literals(msgid, literal_separator)
+            if msgid is None:
+                return None
+            if not text:
+                text = msgid
+
+        timing = ((msgctxt and parse_timing(msgctxt)) or
+            (reference and parse_timing(reference)))
+        if not timing:
+            continue
+
+        if '\\' in text:
+            text = unescape_po_string(text)
+        cues.append(Cue(timing[0], timing[1], text))
+
+    return cues
+
+
+def _iter_po_tokens(content, strict):
+    """Yields the groups of each REGEX_PO_ENTRY match, except junk.
+
+    Raises:
+        ValueError on junk, if strict.
+    """
+    for match in REGEX_PO_ENTRY.finditer(content):
+        groups = match.groups()
+        if groups[-1] is None:
+            yield groups
+        elif strict:
+            raise ValueError('Format not understood: %r' % groups[-1])
+
+
+def _iter_po_matches(content, literal_separator, strict):
+    for (comments, _, msgctxt, msgctxt_more, msgid, msgid_more, msgstr,
+            msgstr_more, msgid_plural, msgid_plural_more, msgstr_plural,
+            obsolete, _) in _iter_po_tokens(content, strict):
+        if obsolete:
+            obsolete = REGEX_PO_OBSOLETE_PREFIX.sub('', obsolete)
+            for entry in _iter_po_matches(obsolete, literal_separator, False):
+                entry.obsolete = True
+                if comments:
+                    _parse_po_comments(entry, comments)
+                yield entry
+            continue
+
+        entry = PoEntry(_parse_po_string(msgid, msgid_more, literal_separator))
+
+        if comments:
+            _parse_po_comments(entry, comments)
+
+        if msgctxt is not None:
+            entry.msgctxt = _parse_po_string(msgctxt, msgctxt_more,
+                literal_separator)
+
+        if msgstr is not None:
+            entry.msgstr = _parse_po_string(msgstr, msgstr_more,
+                literal_separator)
+        else:
+            entry.msgid_plural = _parse_po_string(msgid_plural,
+                msgid_plural_more, literal_separator)
+            for msgstr_match in REGEX_PO_MSGSTR_PLURAL.finditer(msgstr_plural):
+                index = int(msgstr_match.group('index'))
+                entry.msgstr_plural.extend(
+                    [''] * (index + 1 - len(entry.msgstr_plural)))
+                entry.msgstr_plural[index] = unescape_po_string(
+                    literal_separator.join(REGEX_PO_LITERAL.findall(
+                        msgstr_match.group('strings'))))
+
+        yield entry
+
+
+def iter_po_entries(content, literal_separator=''):
+    """Parses a gettext catalog, yielding a PoEntry for every entry,
+    including the header and obsolete ('#~') entries.
+
+    The whole buffer is tokenized with a single REGEX_PO_ENTRY pass, and
+    each string is unescaped once, after its literals are joined.
+
+    Arguments:
+        content - the .po file contents
+        literal_separator - joins a string's adjacent literals.  The spec
+            concatenates them, but older files from PotTranscriptWriter
+            have one literal per line of text, which need '\n'.
+
+    Raises:
+        ValueError if a line outside of any entry is not a comment.
+    """
+    return _iter_po_matches(_normalize_po_line_breaks(content),
+        literal_separator, True)
+
+
+class PoCatalogWriter(TranscriptWriter):
+    """Writes a complete gettext catalog, one entry per cue.
+
+    Unlike PotTranscriptWriter, each entry's msgctxt is its timing, so
+    identical lines at different times stay separate strings in CrowdIn,
+    and text is escaped.  The timing is also kept in a '#:' reference.
+    """
+
+    DEFAULT_HEADERS = (
+        ('Project-Id-Version', 'CrowdTube-Connector'),
+        ('MIME-Version', '1.0'),
+        ('Content-Type', 'text/plain; charset=UTF-8'),
+        ('Content-Transfer-Encoding', '8bit'),
+        ('X-Generator', 'CrowdTube-Connector'),
+    )
+
+    def __init__(self, reader, headers=DEFAULT_HEADERS, template=False):
+        """
+        Arguments:
+            reader - a TranscriptReader
+            headers - a sequence of (name, value) for the header entry
+            template - if True, write a .pot with empty msgstrs, otherwise
+                each msgstr is a copy of the text, like PotTranscriptWriter
+        """
+        super(PoCatalogWriter, self).__init__(reader)
+        self.headers = headers
+        self.template = template
+
+    def iter_entries(self):
+        header = ''.join('%s: %s\n' % (name, value)
+            for name, value in self.headers)
+        yield format_po_entry(PoEntry(msgid='', msgstr=header))
+
+        for entry in super(PoCatalogWriter, self).iter_entries():
+            yield entry
+
+    def _format_entry(self, cue):
+        timing = cue.timestamp
+        return format_po_entry(PoEntry(
+            msgctxt=timing,
+            msgid=cue.text,
+            msgstr='' if self.template else cue.text,
+            references=[timing]))
+
+
+def transcode_po_to_sub(po_content, fingerprint=False):
+    """Converts .po content straight into .sub content.
+
+    The .po is read as read_po_transcript() reads it, then each cue is
+    formatted, and added to the fingerprint, in a single loop.
+
+    Arguments:
+        fingerprint - if True, also compute the transcript's
+            TranscriptReader.fingerprint() in the same pass
+
+    Returns:
+        The .sub content, identical to
+        SubTranscriptWriter(read_po_transcript(po_content)).content, or a
+        tuple of (content, fingerprint) if fingerprint is True.
+
+    Raises:
+        ValueError if the .po could not be parsed.
+    """
+    entry_format = SubTranscriptWriter.ENTRY_FORMAT
+    pieces = []
+    # The text _update_fingerprint() would hash for each cue, which is
+    # hashed all at once
+    hashed = []
+
+    for cue in read_po_transcript(po_content).cues:
+        text = cue.text
+        pieces.append(entry_format % {
+            'timestamp': format_timing(cue.start, cue.end),
+            'text': text,
+        })
+
+        if fingerprint:
+            if not isinstance(text, unicode):
+                text = text.decode('utf-8')
+            # '%s' formats ints like '%d' does, but faster
+            hashed.append(u'%s,%s\n%s\n\n' % (cue.start, cue.end,
+                u' '.join(text.split())))
+
+    content = ''.join(pieces)
+    if fingerprint:
+        digest = hashlib.sha1(u''.join(hashed).encode('utf-8'))
+        return content, digest.hexdigest()
+    return content
+
+
+def hash_text(text):
+    """Returns a short hash of a cue's text.  Unicode is hashed as utf-8, so
+    text from a decoded .po and from a raw .sub download hash the same.
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+
+class TranscriptDiff(object):
+    """The differences between two transcripts.
+
+    Attributes:
+        added - cues only in the new transcript
+        removed - cues only in the old transcript
+        changed - (old cue, new cue) pairs with the same timing but
+            different text
+        unchanged_count - the number of cues which are identical
+    """
+
+    def __init__(self, added, removed, changed, unchanged_count):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.unchanged_count = unchanged_count
+
+    @property
+    def is_noop(self):
+        """True if both transcripts have exactly the same cues."""
+        return not (self.added or self.removed or self.changed)
+
+    def __repr__(self):
+        return '<TranscriptDiff %i added, %i removed, %i changed, %i unchanged>' % (
+            len(self.added), len(self.removed), len(self.changed),
+            self.unchanged_count)
+
+
+def diff_transcripts(old_reader, new_reader):
+    """Compares two transcripts cue by cue, matching cues by their timing
+    and comparing the hash of their text.
+
+    Both readers keep their cues in time order, so this is a single merge
+    pass over the two.
+
+    Returns:
+        A TranscriptDiff
+    """
+    added = []
+    removed = []
+    changed = []
+    unchanged_count = 0
+
+    old_cues = old_reader.iter_cues()
+    new_cues = new_reader.iter_cues()
+    old_cue = next(old_cues, None)
+    new_cue = next(new_cues, None)
+
+    while old_cue is not None and new_cue is not None:
+        old_key = (old_cue.start, old_cue.end)
+        new_key = (new_cue.start, new_cue.end)
+
+        if old_key < new_key:
+            removed.append(old_cue)
+            old_cue = next(old_cues, None)
+        elif new_key < old_key:
+            added.append(new_cue)
+            new_cue = next(new_cues, None)
+        else:
+            if hash_text(old_cue.text) == hash_text(new_cue.text):
+                unchanged_count += 1
+            else:
+                changed.append((old_cue, new_cue))
+            old_cue = next(old_cues, None)
+            new_cue = next(new_cues, None)
+
+    while old_cue is not None:
+        removed.append(old_cue)
+        old_cue = next(old_cues, None)
+
+    while new_cue is not None:
+        added.append(new_cue)
+        new_cue = next(new_cues, None)
+
+    return TranscriptDiff(added, removed, changed, unchanged_count)
+
+
+# Maps a format name to its (reader class, writer class)
+CODECS = {}
+
+# Maps a file extension to a format name
+EXTENSIONS = {}
+
+# Maps a format name to the extension used when writing it
+FORMAT_EXTENSIONS = {}
+
+
+def register_codec(name, reader_class, writer_class, extensions=()):
+    """Makes a format available to read_transcript() and convert().
+
+    Every reader fills the same Cue model, so any registered reader can be
+    paired with any registered writer.
+
+    Arguments:
+        name - the format name, like 'srt'
+        reader_class - a TranscriptReader subclass that takes the content
+        writer_class - a TranscriptWriter subclass that takes a reader
+        extensions - file extensions, like ('.srt',), used by guess_format()
+    """
+    CODECS[name] = (reader_class, writer_class)
+    for extension in extensions:
+        EXTENSIONS[extension.lower()] = name
+
+    if extensions:
+        FORMAT_EXTENSIONS[name] = extensions[0]
+
+
+def get_codec(name):
+    """Returns the (reader class, writer class) registered for a format."""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError('Unknown transcript format: %s' % name)
+
+
+def guess_format(filename):
+    """Returns the format name for filename's extension, or None."""
+    extension = os.path.splitext(filename)[1].lower()
+    return EXTENSIONS.get(extension)
+
+
+def read_transcript(content, format_name):
+    """Parses content with the reader registered for format_name."""
+    reader_class = get_codec(format_name)[0]
+    return reader_class(content)
+
+
+def convert(content, from_format, to_format):
+    """Parses content once and returns a TranscriptWriter for to_format.
 
-    def _build_sub_file(self):
-        self.content = ""
+    Use the writer's iter_entries(), write_to() or get_file() to stream out
+    the converted transcript.
+    """
+    writer_class = get_codec(to_format)[1]
+    return writer_class(read_transcript(content, from_format))
 
-        for entry in self.reader.list_entries():
-            self.content +=self.ENTRY_FORMAT % {
-                'timestamp': entry[0],
-                'text': entry[1],
-            }
 
+# YouTube's .sub format is the same as .sbv
+register_codec('sub', SubTranscriptReader, SubTranscriptWriter, ('.sub',))
+register_codec('sbv', SubTranscriptReader, SubTranscriptWriter, ('.sbv',))
+# Both read with GettextTranscriptReader.  'po' is registered last, so it is
+# what guess_format() returns for a .po file.
+register_codec('gettext', GettextTranscriptReader, PoCatalogWriter, ('.po',))
+register_codec('po', GettextTranscriptReader, PotTranscriptWriter, ('.po', '.pot'))
+register_codec('srt', SrtTranscriptReader, SrtTranscriptWriter, ('.srt',))
+register_codec('vtt', VttTranscriptReader, VttTranscriptWriter, ('.vtt',))
+register_codec('amara', AmaraJsonTranscriptReader, AmaraJsonTranscriptWriter, ('.json',))
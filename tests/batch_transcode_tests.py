@@ -0,0 +1,63 @@
+"""Tests for tools/batch_transcode.py.
+
+Run from the repository root with:
+    python -m unittest discover -s tests -p '*_tests.py'
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'tools'))
+import batch_transcode
+import format
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+
+class TranscodeFileTest(unittest.TestCase):
+
+    def test_every_format_can_be_written(self):
+        for to_format in format.CODECS:
+            result = batch_transcode.transcode_file(
+                (EXAMPLES_DIR, 'testVideo1.sub', None, to_format, None))
+
+            self.assertEqual(result['error'], None)
+            self.assertEqual(result['dest_name'],
+                'testVideo1' + format.FORMAT_EXTENSIONS[to_format])
+            self.assertTrue(result['cues'])
+
+    def test_errors_are_reported(self):
+        result = batch_transcode.transcode_file(
+            (EXAMPLES_DIR, 'missing.sub', None, 'srt', None))
+        self.assertTrue(result['error'].startswith('IOError'))
+
+    def test_po_files_are_guessed_as_po(self):
+        self.assertEqual(format.guess_format('a.po'), 'po')
+        self.assertEqual(format.guess_format('a.pot'), 'po')
+
+
+class BatchTranscodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dest_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dest_dir)
+
+    def test_directory_to_gettext(self):
+        errors = batch_transcode.batch_transcode(EXAMPLES_DIR, self.dest_dir,
+            'gettext', processes=1, verbose=False)
+        self.assertEqual(errors, [])
+
+        with open(os.path.join(self.dest_dir, 'testVideo1.po'), 'rb') as po:
+            reader = format.GettextTranscriptReader(po.read().decode('utf-8'))
+        with open(os.path.join(EXAMPLES_DIR, 'testVideo1.sub'), 'rb') as sub:
+            expected = format.SubTranscriptReader(sub.read().decode('utf-8'))
+        self.assertEqual(reader.list_entries(), expected.list_entries())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,731 @@
+"""Tests for crowdin.py, which need requests.  No requests are sent to
+CrowdIn.
+
+Run from the repository root with:
+    python -m unittest discover -s tests -p '*_tests.py'
+"""
+import collections
+import cStringIO
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import format
+
+try:
+    import crowdin
+except ImportError:
+    crowdin = None
+
+
+def make_zip(members):
+    """Returns the contents of a zip of members, a dict like {name: text}."""
+    zip_contents = cStringIO.StringIO()
+    zip_file = zipfile.ZipFile(zip_contents, 'w')
+    for name, text in sorted(members.iteritems()):
+        zip_file.writestr(name, text.encode('utf-8'))
+    zip_file.close()
+    return zip_contents.getvalue()
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, body=None, content=None):
+        """
+        Arguments:
+            body - the JSON of the response
+            content - the raw response, like a zip, instead of body
+        """
+        self.status_code = status_code
+        self.content = json.dumps(body) if content is None else content
+        self.headers = {}
+        self.chunk_sizes = []
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size):
+        self.chunk_sizes.append(chunk_size)
+        for start in xrange(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeApiSession(object):
+    """Answers each API action, like 'info' or 'download/fr.zip', with the
+    FakeResponse in responses, or the one returned by a function of the
+    request's kwargs, and records the actions requested.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.actions = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        # Like http://api.crowdin.net/api/project/<identifier>/<action>?...
+        action = url.split('?')[0].split('/project/')[1].partition('/')[2]
+        with self.lock:
+            self.actions.append(action)
+
+        response = self.responses[action]
+        if callable(response):
+            return response(kwargs)
+        return response
+
+
+class FakeSession(object):
+    """Records the files of each upload, and fails any upload of more than
+    one file, or of a file whose path is in bad_paths.
+    """
+
+    def __init__(self, bad_paths=()):
+        self.bad_paths = bad_paths
+        self.uploads = []
+
+    def request(self, method, url, files=None, **kwargs):
+        upload = {}
+        for name, contents in files.iteritems():
+            if not isinstance(contents, basestring):
+                contents = contents.read()
+            # Named like files[path]
+            upload[name[len('files['):-1]] = contents
+        self.uploads.append(upload)
+
+        if len(upload) > 1 or set(upload) & set(self.bad_paths):
+            return FakeResponse(500, {'error': {'message': 'Failed'}})
+        return FakeResponse(200, {'success': True})
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class CrowdInZipFileTest(unittest.TestCase):
+
+    def test_translations_by_path(self):
+        zip_file = crowdin.CrowdInZipFile(make_zip({
+            'es-ES/subtitles/a~1.po': u'caza',
+            'fr/subtitles/a~1.po': u'chasse',
+            'fr/subtitles/b~2.po': u'arc',
+            'README.txt': u'not a translation',
+        }))
+        self.assertEqual(zip_file.get_file_count(), 4)
+
+        translations = zip_file.get_all_translations(
+            crowdin.CrowdInZipFile.get_po_path('a', '1'))
+        self.assertEqual(dict(translations),
+            {'es-ES': u'caza', 'fr': u'chasse'})
+        self.assertEqual(dict(zip_file.get_all_translations(
+            'subtitles/b~2.po')), {'fr': u'arc'})
+        self.assertEqual(dict(zip_file.get_all_translations('README.txt')), {})
+        self.assertEqual(dict(zip_file.get_all_translations('missing.po')), {})
+
+    def test_single_language_zip(self):
+        zip_file = crowdin.CrowdInZipFile(make_zip({
+            'fr/subtitles/a~1.po': u'chasse',
+            'subtitles/b~2.po': u'arc',
+        }), language='fr')
+
+        self.assertEqual(dict(zip_file.get_all_translations(
+            'subtitles/a~1.po')), {'fr': u'chasse'})
+        self.assertEqual(dict(zip_file.get_all_translations(
+            'subtitles/b~2.po')), {'fr': u'arc'})
+
+    def test_translations_are_read_when_looked_up(self):
+        zip_file = crowdin.CrowdInZipFile(make_zip({
+            'fr/subtitles/a~1.po': u'chasse',
+            'es-ES/subtitles/a~1.po': u'caza',
+        }))
+        translations = zip_file.get_all_translations('subtitles/a~1.po')
+
+        reads = []
+        read = zip_file.zip_file.read
+
+        def recording_read(member):
+            reads.append(member)
+            return read(member)
+        zip_file.zip_file.read = recording_read
+
+        self.assertEqual(sorted(translations), ['es-ES', 'fr'])
+        self.assertEqual(reads, [])
+        self.assertEqual(translations['fr'], u'chasse')
+        self.assertEqual(len(reads), 1)
+
+        translations['fr'] = u'replaced'
+        self.assertEqual(translations['fr'], u'replaced')
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class DiskExportTest(unittest.TestCase):
+
+    MEMBERS = {
+        'fr/subtitles/a~1.po': u'chasse',
+        'es-ES/subtitles/a~1.po': u'caza',
+    }
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.zip_contents = make_zip(self.MEMBERS)
+        self.response = FakeResponse(200, content=self.zip_contents)
+
+        self.client = crowdin.CrowdInClient('project', 'key')
+        self.client.session = FakeApiSession({'download/all.zip':
+            self.response})
+        self.client.DOWNLOAD_CHUNK_SIZE = 100
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_download_to_path(self):
+        path = os.path.join(self.temp_dir, 'all.zip')
+        self.assertEqual(self.client.download_translations(dest=path), path)
+        self.assertEqual(self.response.chunk_sizes, [100])
+
+        with open(path, 'rb') as zip_file:
+            self.assertEqual(zip_file.read(), self.zip_contents)
+
+        for use_mmap in (False, True):
+            zip_file = crowdin.CrowdInZipFile.from_path(path, use_mmap)
+            try:
+                self.assertEqual(dict(zip_file.get_all_translations(
+                    'subtitles/a~1.po')), {'fr': u'chasse', 'es-ES': u'caza'})
+            finally:
+                zip_file.close()
+
+    def test_download_to_file(self):
+        dest = tempfile.TemporaryFile(dir=self.temp_dir)
+        self.assertTrue(self.client.download_translations(dest=dest) is dest)
+
+        # Rewound, ready to be read
+        zip_file = crowdin.CrowdInZipFile(dest)
+        self.assertEqual(zip_file.get_file_count(), 2)
+        self.assertEqual(zip_file.get_all_translations(
+            'subtitles/a~1.po')['fr'], u'chasse')
+        zip_file.close()
+
+    def test_failed_download(self):
+        self.client.session.responses['download/all.zip'] = FakeResponse(
+            404, {'error': {'message': 'Not found'}})
+        path = os.path.join(self.temp_dir, 'all.zip')
+        self.assertEqual(self.client.download_translations(dest=path), None)
+        self.assertFalse(os.path.exists(path))
+
+
+def make_info(last_build='2013-07-20 13:00:00', languages=(),
+    last_activity='2013-07-20 13:25:15', files=()):
+    """Returns a FakeResponse to get_project_info().
+
+    Arguments:
+        files - the project's files and directories, like ['dir/a.pot']
+    """
+    root = {'files': []}
+    for path in files:
+        node = root
+        for name in path.split('/')[:-1]:
+            for child in node['files']:
+                if child['name'] == name:
+                    break
+            else:
+                child = {'node_type': 'directory', 'name': name, 'files': []}
+                node['files'].append(child)
+            node = child
+        node['files'].append({'node_type': 'file',
+            'name': path.split('/')[-1]})
+
+    return FakeResponse(200, {
+        'languages': [{'code': code, 'name': code} for code in languages],
+        'files': root['files'],
+        'details': {'last_build': last_build, 'last_activity': last_activity},
+    })
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class ExportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = crowdin.ExportCache(os.path.join(self.temp_dir, 'cache'))
+
+        self.client = crowdin.CrowdInClient('project', 'key')
+        self.client.session = FakeApiSession({
+            'info': make_info('2013-07-20 13:00:00'),
+            'edit-project': FakeResponse(200, {'success': True}),
+            'export': FakeResponse(200, {'success': {'status': 'skipped'}}),
+            'download/all.zip': FakeResponse(200,
+                content=make_zip({'fr/a.po': u'chasse'})),
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_get_and_set(self):
+        self.assertEqual(self.cache.get_last_build('project'), None)
+        self.assertEqual(self.cache.get('project', 'build'), None)
+
+        download_path = self.cache.get_download_path('project')
+        with open(download_path, 'wb') as download_file:
+            download_file.write('zip')
+        zip_path = self.cache.set('project', 'build', download_path)
+
+        self.assertFalse(os.path.exists(download_path))
+        self.assertEqual(self.cache.get_last_build('project'), 'build')
+        self.assertEqual(self.cache.get('project', 'build'), zip_path)
+        self.assertEqual(self.cache.get('project', 'newer'), None)
+        self.assertEqual(self.cache.get('project', 'build', 'fr'), None)
+        self.assertEqual(self.cache.get('other', 'build'), None)
+
+    def test_unchanged_export_is_not_downloaded(self):
+        path = self.client.download_cached_translations(self.cache)
+        self.assertEqual(self.client.session.actions,
+            ['info', 'download/all.zip'])
+        zip_file = crowdin.CrowdInZipFile.from_path(path)
+        self.assertEqual(zip_file.get_all_translations('a.po')['fr'],
+            u'chasse')
+        zip_file.close()
+
+        # A skipped export still checks the last_build
+        self.client.session.actions = []
+        self.assertEqual(self.client.download_cached_translations(self.cache,
+            export=True), path)
+        self.assertEqual(self.client.session.actions,
+            ['edit-project', 'export', 'info'])
+
+        self.client.session.responses['info'] = make_info(
+            '2013-07-21 09:00:00')
+        self.client.session.actions = []
+        self.assertEqual(self.client.download_cached_translations(self.cache),
+            path)
+        self.assertEqual(self.client.session.actions,
+            ['info', 'download/all.zip'])
+        self.assertEqual(self.cache.get_last_build('project'),
+            '2013-07-21 09:00:00')
+
+    def test_failed_download_keeps_the_cache(self):
+        path = self.client.download_cached_translations(self.cache)
+
+        self.client.session.responses.update({
+            'info': make_info('2013-07-21 09:00:00'),
+            'download/all.zip': FakeResponse(500, {'error': {}}),
+        })
+        self.assertEqual(self.client.download_cached_translations(self.cache),
+            None)
+        self.assertEqual(self.cache.get('project', '2013-07-20 13:00:00'), path)
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class LanguageDownloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+        self.client = crowdin.CrowdInClient('project', 'key')
+        self.client.session = FakeApiSession({
+            'info': make_info('build', languages=['fr', 'es-ES', 'de']),
+            # Each language's zip has its own directory, as from CrowdIn
+            'download/fr.zip': FakeResponse(200, content=make_zip({
+                'fr/subtitles/a~1.po': u'chasse',
+                'fr/subtitles/b~2.po': u'arc',
+            })),
+            'download/es-ES.zip': FakeResponse(200, content=make_zip({
+                'es-ES/subtitles/a~1.po': u'caza',
+            })),
+            'download/de.zip': FakeResponse(500, {'error': {}}),
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_download_languages(self):
+        dest_dir = os.path.join(self.temp_dir, 'languages')
+        paths = self.client.download_languages(dest_dir, pool_size=3)
+        self.assertEqual(paths, {
+            'fr': os.path.join(dest_dir, 'fr.zip'),
+            'es-ES': os.path.join(dest_dir, 'es-ES.zip'),
+        })
+
+        for use_mmap in (False, True):
+            merged = crowdin.MergedCrowdInZipFile.from_paths(paths, use_mmap)
+            try:
+                self.assertEqual(merged.get_file_count(), 3)
+                self.assertEqual(dict(merged.get_all_translations(
+                    'subtitles/a~1.po')), {'fr': u'chasse', 'es-ES': u'caza'})
+                self.assertEqual(dict(merged.get_all_translations(
+                    'subtitles/b~2.po')), {'fr': u'arc'})
+            finally:
+                merged.close()
+
+    def test_only_some_languages(self):
+        paths = self.client.download_languages(self.temp_dir, ['es-ES'])
+        self.assertEqual(paths.keys(), ['es-ES'])
+        self.assertEqual(self.client.session.actions, ['download/es-ES.zip'])
+
+    def test_changed_languages(self):
+        fr = {'code': 'fr', 'name': 'French', 'phrases': 10, 'translated': 2,
+            'approved': 1}
+        es = {'code': 'es-ES', 'name': 'Spanish', 'phrases': 10,
+            'translated': 5, 'approved': 5}
+        self.client.session.responses['status'] = FakeResponse(200, [fr, es])
+
+        changed, status = self.client.get_changed_languages()
+        self.assertEqual(changed, set(['fr', 'es-ES']))
+
+        # Kept between runs
+        status = json.loads(json.dumps(status))
+        self.assertEqual(self.client.get_changed_languages(status)[0], set())
+
+        fr['translated'] = 3
+        self.client.session.responses['status'] = FakeResponse(200, [fr, es])
+        self.assertEqual(self.client.get_changed_languages(status)[0],
+            set(['fr']))
+
+
+class FakeProject(object):
+    """Responds to the upload actions like a CrowdIn project, recording
+    the paths of each add-file and update-file, and every add-directory.
+    """
+
+    def __init__(self, info, bad_dirs=()):
+        self.bad_dirs = bad_dirs
+        self.uploads = {'add-file': [], 'update-file': []}
+        self.added_dirs = []
+        self.session = FakeApiSession({
+            'info': info,
+            'add-file': lambda kwargs: self.upload('add-file', kwargs),
+            'update-file': lambda kwargs: self.upload('update-file', kwargs),
+            'add-directory': self.add_directory,
+        })
+
+    def upload(self, action, kwargs):
+        # Named like files[path]
+        self.uploads[action].append(sorted(name[len('files['):-1]
+            for name in kwargs['files']))
+        return FakeResponse(200, {'success': True})
+
+    def add_directory(self, kwargs):
+        name = kwargs['data']['name']
+        self.added_dirs.append(name)
+        if name in self.bad_dirs:
+            return FakeResponse(500, {'error': {'message': 'Failed'}})
+        return FakeResponse(200, {'success': True})
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class ProjectTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.project = FakeProject(make_info(files=['subtitles/a~1.pot']))
+        self.client = crowdin.CrowdInClient('project', 'key')
+        self.client.session = self.project.session
+
+    def test_tree_is_listed_once(self):
+        self.assertEqual(self.client.sync_files({
+            'subtitles/a~1.pot': 'a',
+            'subtitles/b~2.pot': 'b',
+            'topic/c~3.pot': 'c',
+        }), {})
+        self.assertEqual(self.project.uploads, {
+            'add-file': [['subtitles/b~2.pot', 'topic/c~3.pot']],
+            'update-file': [['subtitles/a~1.pot']],
+        })
+        self.assertEqual(self.project.added_dirs, ['topic/'])
+
+        # Known from the first sync, without listing the project again
+        self.assertEqual(self.client.sync_files({'topic/c~3.pot': 'c'}), {})
+        self.assertEqual(self.project.uploads['update-file'][-1],
+            ['topic/c~3.pot'])
+        self.assertEqual(self.project.session.actions.count('info'), 1)
+
+        tree = self.client.get_project_tree()
+        self.assertEqual(tree.files, set(['subtitles/a~1.pot',
+            'subtitles/b~2.pot', 'topic/c~3.pot']))
+        self.assertEqual(tree.dirs, set(['subtitles/', 'topic/']))
+
+    def test_tree_is_replaced_when_the_project_changes(self):
+        tree = self.client.get_project_tree()
+
+        self.client.get_project_info()
+        self.assertTrue(self.client.get_project_tree() is tree)
+
+        # Like a file added by another client
+        self.project.session.responses['info'] = make_info(
+            last_activity='2013-07-21 09:00:00',
+            files=['subtitles/a~1.pot', 'subtitles/b~2.pot'])
+        self.client.get_project_info()
+        self.assertEqual(self.client.get_project_tree().files,
+            set(['subtitles/a~1.pot', 'subtitles/b~2.pot']))
+
+        self.client.invalidate_project_tree()
+        self.client.get_project_tree()
+        self.assertEqual(self.project.session.actions.count('info'), 4)
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class CreateDirectoriesTest(unittest.TestCase):
+
+    def make_client(self, bad_dirs=()):
+        self.project = FakeProject(make_info(files=['math/intro.pot']),
+            bad_dirs)
+        client = crowdin.CrowdInClient('project', 'key')
+        client.session = self.project.session
+        return client
+
+    def test_parents_are_created_first(self):
+        client = self.make_client()
+        self.assertEqual(client.create_directories(['math/algebra/linear/',
+            'science/physics', 'math/geometry/']), set())
+
+        added_dirs = self.project.added_dirs
+        self.assertEqual(sorted(added_dirs), ['math/algebra/',
+            'math/algebra/linear/', 'math/geometry/', 'science/',
+            'science/physics/'])
+        for child, parent in (('math/algebra/linear/', 'math/algebra/'),
+                ('science/physics/', 'science/')):
+            self.assertTrue(added_dirs.index(parent) < added_dirs.index(child))
+
+        # Now in the project tree
+        self.assertEqual(client.create_directories(['math/algebra/linear']),
+            set())
+        self.assertEqual(len(self.project.added_dirs), 5)
+
+    def test_children_of_failed_directories_are_skipped(self):
+        client = self.make_client(bad_dirs=['science/'])
+        self.assertEqual(client.create_directories(['science/physics/atoms/',
+            'math/algebra/']), set(['science/', 'science/physics/',
+            'science/physics/atoms/']))
+        self.assertEqual(sorted(self.project.added_dirs),
+            ['math/algebra/', 'science/'])
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class UploadQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.project = FakeProject(make_info())
+        self.client = crowdin.CrowdInClient('project', 'key')
+        self.client.session = self.project.session
+        self.client.UPLOAD_BATCH_SIZE = 2
+
+    def test_files_are_uploaded_together(self):
+        queue = crowdin.UploadQueue(self.client)
+        for i in xrange(5):
+            queue.add('subtitles/%i.pot' % i, 'old')
+        queue.add('subtitles/0.pot', 'new')
+        self.assertEqual(len(queue), 5)
+        self.assertEqual(self.project.session.actions, [])
+
+        self.assertEqual(queue.flush(), {})
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(self.project.added_dirs, ['subtitles/'])
+        self.assertEqual(sorted(path
+                for batch in self.project.uploads['add-file']
+                for path in batch),
+            ['subtitles/%i.pot' % i for i in xrange(5)])
+        self.assertEqual(sorted(len(batch)
+            for batch in self.project.uploads['add-file']), [1, 2, 2])
+
+        # Nothing left to upload
+        queue.flush()
+        self.assertEqual(self.project.session.actions.count('add-file'), 3)
+
+    def test_flushed_when_too_large(self):
+        queue = crowdin.UploadQueue(self.client, max_pending_bytes=10)
+        queue.add('a.pot', '12345')
+        queue.add('a.pot', '123456')
+        self.assertEqual(queue.pending_bytes, 6)
+        self.assertEqual(self.project.uploads['add-file'], [])
+
+        # A stream is read, so it can be measured
+        stream = format.PoCatalogWriter(format.SubTranscriptReader(
+            u'0:00:01.000,0:00:02.000\nhola\n\n')).get_file()
+        queue.add('b.pot', stream)
+        self.assertEqual(self.project.uploads['add-file'], [['a.pot', 'b.pot']])
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.pending_bytes, 0)
+
+
+class SlowClient(object):
+    """Stands in for a CrowdInClient, recording how many calls of each
+    method run at once.
+    """
+    CONNECTION_POOL_SIZE = 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = collections.Counter()
+        self.most_running = collections.Counter()
+
+    def _call(self, name, result):
+        with self.lock:
+            self.running[name] += 1
+            self.running['all'] += 1
+            for key in (name, 'all'):
+                self.most_running[key] = max(self.most_running[key],
+                    self.running[key])
+
+        time.sleep(0.02)
+
+        with self.lock:
+            self.running[name] -= 1
+            self.running['all'] -= 1
+        return result
+
+    def get_project_info(self):
+        return self._call('get_project_info', {'details': {}})
+
+    def build_export_zip(self, approved_only=True):
+        return self._call('build_export_zip', 'built')
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class AsyncCrowdInClientTest(unittest.TestCase):
+
+    def test_same_results_as_the_client(self):
+        project = FakeProject(make_info(files=['subtitles/a~1.pot']))
+        client = crowdin.CrowdInClient('project', 'key')
+        client.session = project.session
+        async_client = crowdin.AsyncCrowdInClient(client)
+
+        info = async_client.get_project_info()
+        added = async_client.add_files({'subtitles/b~2.pot': 'b'})
+        updated = async_client.update_files({'subtitles/a~1.pot': 'a'})
+
+        self.assertEqual(info.get()['details']['last_build'],
+            '2013-07-20 13:00:00')
+        self.assertEqual(added.get(), {})
+        self.assertEqual(updated.get(), {})
+        async_client.close()
+
+        self.assertEqual(project.uploads, {
+            'add-file': [['subtitles/b~2.pot']],
+            'update-file': [['subtitles/a~1.pot']],
+        })
+
+    def test_concurrency_limits(self):
+        client = SlowClient()
+        async_client = crowdin.AsyncCrowdInClient(client)
+
+        results = [async_client.build_export_zip() for _ in xrange(3)]
+        results += [async_client.get_project_info() for _ in xrange(4)]
+        self.assertEqual([result.get() for result in results],
+            ['built'] * 3 + [{'details': {}}] * 4)
+        async_client.close()
+
+        self.assertEqual(client.most_running['build_export_zip'], 1)
+        # Limited by the connections, not the 4 get_project_info threads
+        self.assertTrue(client.most_running['all'] <= 2)
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class UploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = crowdin.CrowdInClient('project', 'key')
+
+        reader = format.SubTranscriptReader(
+            u'0:00:01.000,0:00:02.000\nhe said "hi"\n\n')
+        self.content = format.PoCatalogWriter(reader).content.encode('utf-8')
+
+    def get_files(self):
+        # Streams which can only be read once, like the sync uploads
+        return {
+            'a/one.po': format.PoCatalogWriter(
+                format.GettextTranscriptReader(self.content)).get_file(),
+            'a/two.po': format.PoCatalogWriter(
+                format.GettextTranscriptReader(self.content)).get_file(),
+        }
+
+    def test_failed_batch_is_retried_with_whole_files(self):
+        for upload_files in (self.client.add_files, self.client.update_files):
+            self.client.session = FakeSession()
+
+            self.assertEqual(upload_files(self.get_files()), {})
+
+            uploads = self.client.session.uploads
+            self.assertEqual(len(uploads), 3)
+            self.assertEqual(sorted(uploads[0]), ['a/one.po', 'a/two.po'])
+            for upload in uploads:
+                for contents in upload.itervalues():
+                    self.assertEqual(contents, self.content)
+
+    def test_failed_file_is_reported(self):
+        self.client.session = FakeSession(bad_paths=['a/two.po'])
+
+        self.assertEqual(self.client.add_files(self.get_files()),
+            {'a/two.po': 'Failed'})
+        self.assertEqual(self.client.session.uploads[-1],
+            {'a/two.po': self.content})
+
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_pause(self):
+        # Slow enough that oversleeping the pause does not refill a token
+        bucket = crowdin.TokenBucket(5, 3)
+
+        start = time.time()
+        for _ in xrange(3):
+            bucket.acquire()
+        self.assertTrue(time.time() - start < 0.05)
+
+        bucket.pause(0.1)
+        bucket.acquire()
+        self.assertTrue(time.time() - start >= 0.1)
+        self.assertTrue(bucket.tokens < 1)
+
+
+@unittest.skipIf(crowdin is None, 'crowdin.py needs requests')
+class ExportTimesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'export_times.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_client(self, identifier='project'):
+        client = crowdin.CrowdInClient(identifier, 'key', self.path)
+        client.session = FakeSession()
+        return client
+
+    def test_export_time_is_remembered_between_runs(self):
+        self.make_client()._set_last_export_time(100)
+        self.make_client('other')._set_last_export_time(200)
+
+        with open(self.path, 'r') as export_times_file:
+            self.assertEqual(json.load(export_times_file),
+                {'project': 100, 'other': 200})
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        self.assertEqual(self.make_client().get_next_export_time(),
+            100 + crowdin.CrowdInClient.EXPORT_INTERVAL)
+
+    def test_export_is_throttled(self):
+        self.make_client()._set_last_export_time(time.time())
+
+        client = self.make_client()
+        self.assertEqual(client.build_export_zip(), 'throttled')
+        self.assertEqual(client.session.uploads, [])
+
+    def test_bad_file_is_ignored(self):
+        for contents in ('{"project": 1', '[]'):
+            with open(self.path, 'w') as export_times_file:
+                export_times_file.write(contents)
+
+            client = self.make_client()
+            self.assertEqual(client.get_next_export_time(), 0)
+
+            client._set_last_export_time(100)
+            self.assertEqual(self.make_client().get_next_export_time(),
+                100 + crowdin.CrowdInClient.EXPORT_INTERVAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
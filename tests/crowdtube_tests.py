@@ -0,0 +1,82 @@
+"""Tests for crowdtube.py, which need requests, the gdata library and a
+secrets.py, see secrets-example.py.  Nothing is sent to YouTube or CrowdIn.
+
+Run from the repository root with:
+    python -m unittest discover -s tests -p '*_tests.py'
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import format
+
+try:
+    import crowdtube
+except ImportError:
+    crowdtube = None
+
+
+@unittest.skipIf(crowdtube is None,
+    'crowdtube.py needs requests, gdata and secrets.py')
+class TrackFingerprintsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'fingerprints.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_saved_and_loaded(self):
+        fingerprints = crowdtube.TrackFingerprints(self.path)
+        self.assertEqual(fingerprints.get('video', 'es-ES'), None)
+
+        fingerprints.set('video', 'es-ES', 'abc')
+        fingerprints.save()
+        fingerprints.set('video', 'fr', 'def')
+        fingerprints.save()
+
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        fingerprints = crowdtube.TrackFingerprints(self.path)
+        self.assertEqual(fingerprints.get('video', 'es-ES'), 'abc')
+        self.assertEqual(fingerprints.get('video', 'fr'), 'def')
+        self.assertEqual(fingerprints.get('other', 'fr'), None)
+
+    def test_unreadable_file_is_ignored(self):
+        with open(self.path, 'w') as fingerprints_file:
+            fingerprints_file.write('{"video:fr": ')
+
+        fingerprints = crowdtube.TrackFingerprints(self.path)
+        self.assertEqual(fingerprints.get('video', 'fr'), None)
+
+        fingerprints.set('video', 'fr', 'def')
+        fingerprints.save()
+        with open(self.path, 'r') as fingerprints_file:
+            self.assertEqual(json.load(fingerprints_file), {'video:fr': 'def'})
+
+
+@unittest.skipIf(crowdtube is None,
+    'crowdtube.py needs requests, gdata and secrets.py')
+class ReadPoTranslationTest(unittest.TestCase):
+
+    def test_fingerprint_matches_the_uploaded_track(self):
+        reader = format.SubTranscriptReader(
+            u'0:00:01.000,0:00:02.000\nhe said "hi"\n\n'
+            u'0:00:03.000,0:00:04.000\ncaza\ncon arco\n\n')
+        po_content = format.PoCatalogWriter(reader).content
+
+        content, fingerprint = crowdtube.read_po_translation(po_content, 'es')
+        self.assertEqual(content, format.SubTranscriptWriter(reader).content)
+        self.assertEqual(fingerprint, reader.fingerprint())
+
+        # The fingerprint a later sync compares with the downloaded track
+        self.assertEqual(format.SubTranscriptReader(
+            content.encode('utf-8')).fingerprint(), fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Tests for tools/format_benchmark.py.
+
+Run from the repository root with:
+    python -m unittest discover -s tests -p '*_tests.py'
+"""
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'tools'))
+import format
+import format_benchmark
+
+
+class CorpusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus = format_benchmark.generate_corpus(200,
+            scripts=sorted(format_benchmark.SCRIPTS))
+
+    def test_corpus_is_deterministic(self):
+        corpus = format_benchmark.generate_corpus(200,
+            scripts=sorted(format_benchmark.SCRIPTS))
+        for key in ('sub', 'po', 'gettext'):
+            self.assertEqual(corpus[key], self.corpus[key])
+
+        other = format_benchmark.generate_corpus(200, seed=1,
+            scripts=sorted(format_benchmark.SCRIPTS))
+        self.assertNotEqual(other['sub'], self.corpus['sub'])
+
+    def test_every_benchmark_reads_the_corpus(self):
+        expected = self.corpus['reader'].list_entries()
+        self.assertEqual(len(expected), 200)
+
+        for name, (input_key, function) in format_benchmark.BENCHMARKS.items():
+            result = function(self.corpus[input_key])
+            if isinstance(result, format.TranscriptReader):
+                self.assertEqual(result.list_entries(), expected, name)
+
+    def test_baseline_matches_readers(self):
+        entries = format_benchmark.baseline_pot_reader(self.corpus['po'])
+        self.assertEqual(sorted(entries.iteritems()),
+            format.PotTranscriptReader(self.corpus['po']).list_entries())
+
+
+class CompareResultsTest(unittest.TestCase):
+
+    def test_regressions(self):
+        baseline = {
+            'faster': {'cues_per_sec': 100.0},
+            'slower': {'cues_per_sec': 100.0},
+            'noisy': {'cues_per_sec': 100.0},
+        }
+        results = {
+            'faster': {'cues_per_sec': 150.0},
+            'slower': {'cues_per_sec': 80.0},
+            'noisy': {'cues_per_sec': 95.0},
+            'new': {'cues_per_sec': 10.0},
+        }
+        self.assertEqual(
+            format_benchmark.compare_results(results, baseline, 0.1),
+            ['slower'])
+
+
+if __name__ == '__main__':
+    unittest.main()
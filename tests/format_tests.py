@@ -1 +1,663 @@
-# TODO(mattfaus): Implement
+# -*- coding: utf-8 -*-
+"""Tests for format.py.
+
+Run from the repository root with:
+    python -m unittest discover -s tests -p '*_tests.py'
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import format
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', 'examples')
+
+
+def read_example(name):
+    with open(os.path.join(EXAMPLES_DIR, name), 'rb') as example_file:
+        return example_file.read().decode('utf-8')
+
+
+def random_cues(rand, cue_count, in_order=True):
+    """Returns cue_count format.Cue objects with one or two lines of text,
+    sometimes sharing a timing, and shuffled unless in_order.
+    """
+    words = [u'bowhunting', u'caza', u'вода', u'υδωρ', u'水', u'ماء', u'x']
+    cues = []
+    start = 0
+
+    for _ in xrange(cue_count):
+        if cues and rand.random() < 0.05:
+            # The same timing as the last cue
+            start, end = cues[-1].start, cues[-1].end
+        else:
+            end = start + rand.randint(1, 5000)
+
+        lines = [u' '.join(rand.choice(words) for _ in xrange(rand.randint(1, 6)))
+            for _ in xrange(rand.randint(1, 2))]
+        cues.append(format.Cue(start, end, u'\n'.join(lines)))
+        start = end + rand.randint(0, 500)
+
+    if not in_order:
+        rand.shuffle(cues)
+    return cues
+
+
+class _CueListReader(format.TranscriptReader):
+
+    def __init__(self, cues):
+        self._set_cues(cues)
+
+
+def as_tuples(cues):
+    return [(cue.start, cue.end, cue.text) for cue in cues]
+
+
+class TimestampTest(unittest.TestCase):
+
+    def test_timestamp_to_ms(self):
+        self.assertEqual(format.timestamp_to_ms('1:02:03.004'), 3723004)
+        self.assertEqual(format.timestamp_to_ms('00:00:01,389'), 1389)
+        self.assertEqual(format.timestamp_to_ms('00:01.389'), 1389)
+        self.assertEqual(format.timestamp_to_ms('0:00:01.5'), 1500)
+
+    def test_signs_and_spaces_are_rejected(self):
+        for timestamp in ('0:-1:00.000', '0: 1: 2.003', '0:00:01.+12'):
+            self.assertRaises(ValueError, format.timestamp_to_ms, timestamp)
+        self.assertEqual(format.parse_timing('0:-1:00.000,0:00:01.000'), None)
+
+    def test_round_trips(self):
+        rand = random.Random(8)
+        for ms in [0, 999, 1000, 59999, 3600000, 36000000 + 1] + [
+                rand.randint(0, 100 * 3600000) for _ in xrange(1000)]:
+            timestamp = format.ms_to_timestamp(ms)
+            self.assertEqual(format.timestamp_to_ms(timestamp), ms)
+            self.assertEqual(format.timestamp_to_ms(
+                format.ms_to_timestamp(ms, '%02d:%02d:%02d,%03d')), ms)
+            self.assertEqual(format.parse_timing(
+                format.format_timing(ms, ms + 1)), (ms, ms + 1))
+
+        self.assertEqual(format.ms_to_timestamp(36000001), '10:00:00.001')
+
+    def test_parse_timing(self):
+        self.assertEqual(format.parse_timing('0:00:01.389,0:00:06.839'),
+            (1389, 6839))
+        self.assertEqual(format.parse_timing('00:00:01,389,00:00:06,839'),
+            None)
+        for timing in ('0:00:01.389', '0:00:01,0:00:02', '', 'caza,con arco'):
+            self.assertEqual(format.parse_timing(timing), None)
+
+
+class CueIntervalIndexTest(unittest.TestCase):
+
+    def test_matches_a_scan(self):
+        rand = random.Random(7)
+        for cue_count in (0, 1, 2, 17, 200):
+            # Long cues overlap many of the later ones
+            starts = sorted(rand.randint(0, 20000) for _ in xrange(cue_count))
+            ends = [start + rand.choice([0, 10, 500, 8000]) for start in starts]
+            index = format.CueIntervalIndex(starts, ends)
+            self.assertEqual(len(index), cue_count)
+
+            for _ in xrange(50):
+                start = rand.randint(-100, 30000)
+                end = start + rand.choice([1, 100, 5000])
+                self.assertEqual(index.overlapping(start, end),
+                    [i for i in xrange(cue_count)
+                        if starts[i] < end and ends[i] > start])
+                self.assertEqual(index.at(start), [i for i in xrange(cue_count)
+                    if starts[i] <= start < ends[i]])
+
+    def test_reader_queries(self):
+        reader = _CueListReader([
+            format.Cue(0, 5000, u'long'),
+            format.Cue(1000, 2000, u'one'),
+            format.Cue(2000, 3000, u'two'),
+        ])
+        self.assertEqual([cue.text for cue in reader.cues_at(2000)],
+            [u'long', u'two'])
+        self.assertEqual([cue.text for cue in reader.cues_overlapping(1500,
+            2500)], [u'long', u'one', u'two'])
+        self.assertEqual(reader.cues_at(5000), [])
+
+
+class CueTimingsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = _CueListReader([
+            format.Cue(100, 1000, u'one'),
+            format.Cue(300, 2000, u'two'),
+            format.Cue(2500, 4000, u'three'),
+        ])
+
+    def assert_timings(self, timings, expected):
+        self.assertEqual(zip(timings.starts, timings.ends), expected)
+
+    def test_operations(self):
+        timings = self.reader.get_timings()
+        self.assert_timings(timings.shift(-200),
+            [(0, 800), (100, 1800), (2300, 3800)])
+        self.assert_timings(timings.scale(2, origin=100),
+            [(-100, 1500), (100, 3500), (4500, 7500)])
+        self.assert_timings(timings.snap(10), [(-100, 1500), (100, 3500),
+            (4500, 7500)])
+        self.assertEqual(timings.find_overlaps(), [0])
+        self.assert_timings(timings.repair_overlaps(gap=50),
+            [(-100, 50), (100, 3500), (4500, 7500)])
+        self.assertRaises(ValueError, timings.scale, 0)
+
+        # The reader is only changed by set_timings()
+        self.assertEqual(self.reader.cues[0].start, 100)
+
+    def test_set_timings(self):
+        self.assertEqual(as_tuples(self.reader.cues_at(500)),
+            [(100, 1000, u'one'), (300, 2000, u'two')])
+
+        self.reader.set_timings(self.reader.get_timings().shift(3000))
+        self.assertEqual(as_tuples(self.reader.cues_at(500)), [])
+        self.assertEqual(as_tuples(self.reader.cues_at(3500)),
+            [(3100, 4000, u'one'), (3300, 5000, u'two')])
+
+        self.assertRaises(ValueError, self.reader.set_timings,
+            format.CueTimings([0], [1]))
+
+    def test_set_timings_reorders_and_merges(self):
+        timings = self.reader.get_timings()
+        timings.starts[0] = 5000
+        timings.ends[0] = 6000
+        self.reader.set_timings(timings)
+        self.assertEqual([cue.text for cue in self.reader.cues],
+            [u'two', u'three', u'one'])
+
+        # Clipped at zero, both cues now have the same timing
+        reader = _CueListReader([format.Cue(0, 500, u'first'),
+            format.Cue(100, 600, u'second')])
+        timings = reader.get_timings().shift(-1000)
+        reader.set_timings(timings)
+        self.assertEqual(as_tuples(reader.cues), [(0, 0, u'second')])
+        self.assertEqual(as_tuples(reader.cues_at(0)), [])
+
+
+class PotTranscriptReaderTest(unittest.TestCase):
+
+    def assert_parsers_agree(self, content):
+        by_regex = format.PotTranscriptReader(content)
+        by_line = format.PotTranscriptReader(content, use_regex=False)
+        self.assertEqual(by_regex.list_entries(), by_line.list_entries())
+        return by_regex
+
+    def test_regex_matches_line_parser_on_examples(self):
+        for name in ('testVideo1.sub.pot', 'testVideo1.sub-es-ES.po'):
+            reader = self.assert_parsers_agree(read_example(name))
+            self.assertTrue(reader.cues)
+
+    def test_regex_matches_line_parser_on_generated_files(self):
+        rand = random.Random(0)
+        for _ in xrange(20):
+            reader = _CueListReader(random_cues(rand, 100))
+            content = format.PotTranscriptWriter(reader).content
+            self.assertEqual(self.assert_parsers_agree(content).list_entries(),
+                reader.list_entries())
+
+    def test_regex_matches_line_parser_on_windows_line_breaks(self):
+        content = read_example('testVideo1.sub-es-ES.po').replace('\n', '\r\n')
+        self.assert_parsers_agree(content)
+
+    def test_cues_are_ordered_and_later_timings_win(self):
+        content = u''.join(u'#: %s\nmsgid "x"\nmsgstr "%s"\n\n' % entry for entry in [
+            ('0:00:03.000,0:00:04.000', u'three'),
+            ('0:00:01.000,0:00:02.000', u'one'),
+            ('0:00:03.000,0:00:04.000', u'three again'),
+            ('0:00:01.000,0:00:01.500', u'short one'),
+            ('10:00:00.000,10:00:01.000', u'ten hours'),
+            ('0:00:05,0:00:06', u'no milliseconds'),
+        ])
+        self.assertEqual(self.assert_parsers_agree(content).list_entries(), [
+            ('0:00:01.000,0:00:01.500', u'short one'),
+            ('0:00:01.000,0:00:02.000', u'one'),
+            ('0:00:03.000,0:00:04.000', u'three again'),
+            ('0:00:05.000,0:00:06.000', u'no milliseconds'),
+            ('10:00:00.000,10:00:01.000', u'ten hours'),
+        ])
+
+    def test_only_newlines_end_lines(self):
+        # As for gettext, a form feed or U+2028 is part of the text
+        for text in (u'form\x0cfeed', u'line\u2028separator'):
+            content = u'#: 0:00:01.000,0:00:02.000\nmsgid "x"\nmsgstr "%s"\n' % text
+            self.assertEqual(self.assert_parsers_agree(content).list_entries(),
+                [('0:00:01.000,0:00:02.000', text)])
+
+    def test_timestamps_without_msgstr(self):
+        # Each of these used to be searched to the end of the file
+        content = ''.join('#: %s\nmsgid "x"\n\n' % format.format_timing(
+            i * 1000, i * 1000 + 500) for i in xrange(3000))
+        self.assertEqual(self.assert_parsers_agree(content).cues, [])
+
+
+class TranscodePoToSubTest(unittest.TestCase):
+
+    def assert_transcodes(self, content):
+        reader = format.read_po_transcript(content)
+        expected = format.SubTranscriptWriter(reader).content
+
+        self.assertEqual(format.transcode_po_to_sub(content), expected)
+        self.assertEqual(format.transcode_po_to_sub(content, fingerprint=True),
+            (expected, reader.fingerprint()))
+        return expected
+
+    def test_examples(self):
+        for name in ('testVideo1.sub.pot', 'testVideo1.sub-es-ES.po'):
+            self.assert_transcodes(read_example(name))
+
+    def test_catalogs(self):
+        reader = _CueListReader(random_cues(random.Random(2), 100))
+        expected = format.SubTranscriptWriter(reader).content
+
+        for template in (False, True):
+            # Untranslated entries use their msgid, as in the sync
+            content = format.PoCatalogWriter(reader, template=template).content
+            self.assertEqual(self.assert_transcodes(content), expected)
+
+    def test_legacy_quotes(self):
+        content = (u'#: 0:00:01.000,0:00:02.000\n'
+            u'msgid "he said "hi""\nmsgstr "dijo "hola""\n')
+        self.assertEqual(self.assert_transcodes(content),
+            u'0:00:01.000,0:00:02.000\ndijo "hola"\n\n')
+
+    def test_generated_files(self):
+        rand = random.Random(1)
+        for in_order in (True, False):
+            for _ in xrange(10):
+                cues = random_cues(rand, 100, in_order)
+                # Written in the given order, not sorted by a reader
+                content = u''.join(format.PotTranscriptWriter.ENTRY_FORMAT % {
+                    'timestamp': cue.timestamp,
+                    'text': cue.text.replace('\n', '"\n"'),
+                } for cue in cues)
+                self.assert_transcodes(content)
+
+
+class GettextTranscriptReaderTest(unittest.TestCase):
+
+    TEXTS = [
+        u'he said "hi"',
+        u'back\\slash',
+        u'tab\there',
+        u'two\nlines',
+        u'ends with a backslash \\',
+        u'\\n is not a line break',
+        u'caza con arco',
+    ]
+
+    def setUp(self):
+        self.reader = _CueListReader([format.Cue(i * 1000, i * 1000 + 900, text)
+            for i, text in enumerate(self.TEXTS)])
+
+    def test_catalog_round_trip(self):
+        content = format.PoCatalogWriter(self.reader).content
+        self.assertEqual(format.GettextTranscriptReader(content).list_entries(),
+            self.reader.list_entries())
+
+    def test_po_codec_round_trip(self):
+        content = format.convert(
+            format.SubTranscriptWriter(self.reader).content, 'sub', 'po').content
+
+        for reader in (format.read_transcript(content, 'po'),
+                format.PotTranscriptReader(content),
+                format.PotTranscriptReader(content, use_regex=False)):
+            self.assertEqual(reader.list_entries(), self.reader.list_entries())
+
+    def test_matches_iter_po_entries(self):
+        content = format.PoCatalogWriter(self.reader).content
+        entries = [entry for entry in format.iter_po_entries(content)
+            if entry.msgctxt]
+        self.assertEqual([entry.msgstr for entry in entries], self.TEXTS)
+
+    def test_catalog_entries_which_need_the_full_parser(self):
+        content = (
+            u'#: 0:00:01.000,0:00:02.000\n'
+            u'#, fuzzy\n'
+            u'msgctxt "0:00:01.000,0:00:02.000"\n'
+            u'msgid "fuzzy"\n'
+            u'msgstr "fuzzy"\n'
+            u'\n'
+            u'#: 0:00:03.000,0:00:04.000\n'
+            u'msgctxt ""\n'
+            u'"0:00:03.000,0:00:04.000"\n'
+            u'msgid "split"\n'
+            u'msgstr ""\n'
+            u'\n'
+            u'#: 0:00:05.000,0:00:06.000\n'
+            u'msgctxt "0:00:05.000,0:00:06.000"\n'
+            u'msgid "fast"\n'
+            u'msgstr "rápido"\n'
+        )
+        self.assertEqual(format.GettextTranscriptReader(content).list_entries(), [
+            ('0:00:01.000,0:00:02.000', u'fuzzy'),
+            ('0:00:03.000,0:00:04.000', u'split'),
+            ('0:00:05.000,0:00:06.000', u'rápido'),
+        ])
+        self.assertEqual(len(format.GettextTranscriptReader(content,
+            skip_fuzzy=True).cues), 2)
+
+    def test_shortcut_matches_full_parser(self):
+        for content in (format.PoCatalogWriter(self.reader).content,
+                format.PoCatalogWriter(self.reader, template=True).content,
+                format.PotTranscriptWriter(self.reader).content):
+            # A translator comment needs the full parser
+            full = format.GettextTranscriptReader(u'# comment\n' + content)
+            self.assertEqual(format.GettextTranscriptReader(content).cues,
+                full.cues)
+            self.assertEqual(full.list_entries(), self.reader.list_entries())
+
+    def test_junk_is_an_error(self):
+        content = format.PoCatalogWriter(self.reader).content + u'junk\n'
+        self.assertRaises(ValueError, format.GettextTranscriptReader, content)
+
+    def test_unescaped_quotes_are_errors(self):
+        for msgstr in (u'"he said "hi""', u'"escaped end\\"', u'"a\\"\n"b"'):
+            content = (u'#: 0:00:01.000,0:00:02.000\nmsgid "x"\nmsgstr %s\n'
+                % msgstr)
+            self.assertRaises(ValueError, format.GettextTranscriptReader,
+                content)
+
+    def test_read_po_transcript_reads_legacy_quotes(self):
+        # Older PotTranscriptWriter files did not escape quotes
+        content = (u'#: 0:00:01.000,0:00:02.000\n'
+            u'msgid "he said "hi""\nmsgstr "dijo "hola""\n\n'
+            u'#: 0:00:03.000,0:00:04.000\nmsgid "bye"\nmsgstr "adiós"\n')
+        self.assertEqual(format.read_po_transcript(content).list_entries(), [
+            ('0:00:01.000,0:00:02.000', u'dijo "hola"'),
+            ('0:00:03.000,0:00:04.000', u'adiós'),
+        ])
+
+        content = format.PoCatalogWriter(self.reader).content
+        reader = format.read_po_transcript(content)
+        self.assertTrue(isinstance(reader, format.GettextTranscriptReader))
+        self.assertEqual(reader.list_entries(), self.reader.list_entries())
+
+
+class PoCatalogWriterTest(unittest.TestCase):
+
+    def test_header_and_repeated_lines(self):
+        reader = _CueListReader([
+            format.Cue(1000, 2000, u'hola'),
+            format.Cue(3000, 4000, u'hola'),
+        ])
+        entries = list(format.iter_po_entries(
+            format.PoCatalogWriter(reader, template=True).content))
+
+        header = entries[0]
+        self.assertEqual(header.msgid, '')
+        self.assertTrue('Content-Type: text/plain; charset=UTF-8\n'
+            in header.msgstr)
+
+        self.assertEqual([(entry.msgctxt, entry.msgid, entry.msgstr,
+            entry.references) for entry in entries[1:]], [
+            ('0:00:01.000,0:00:02.000', u'hola', u'',
+                ['0:00:01.000,0:00:02.000']),
+            ('0:00:03.000,0:00:04.000', u'hola', u'',
+                ['0:00:03.000,0:00:04.000']),
+        ])
+
+    def test_format_po_entry(self):
+        entry = format.PoEntry(msgid=u'he said "hi"\n', msgstr=u'tab\there',
+            flags=['fuzzy'], comments=[u'translator'])
+        self.assertEqual(format.format_po_entry(entry),
+            u'# translator\n'
+            u'#, fuzzy\n'
+            u'msgid "he said \\"hi\\"\\n"\n'
+            u'msgstr "tab\\there"\n'
+            u'\n')
+
+        entry = format.PoEntry(msgid=u'one', msgid_plural=u'many',
+            msgstr_plural=[u'uno', u'muchos'], obsolete=True)
+        self.assertEqual(format.format_po_entry(entry),
+            u'#~ msgid "one"\n'
+            u'#~ msgid_plural "many"\n'
+            u'#~ msgstr[0] "uno"\n'
+            u'#~ msgstr[1] "muchos"\n'
+            u'\n')
+
+    def test_entries_round_trip(self):
+        entries = [
+            format.PoEntry(msgid=u'back\\slash', msgstr=u'two\nlines',
+                msgctxt=u'0:00:01.000,0:00:02.000', flags=['fuzzy']),
+            format.PoEntry(msgid=u'one', msgid_plural=u'many',
+                msgstr_plural=[u'uno', u'muchos']),
+            format.PoEntry(msgid=u'gone', msgstr=u'ido', obsolete=True),
+        ]
+        content = u''.join(format.format_po_entry(entry) for entry in entries)
+
+        parsed = list(format.iter_po_entries(content))
+        self.assertEqual(len(parsed), len(entries))
+        for expected, entry in zip(entries, parsed):
+            for name in format.PoEntry.__slots__:
+                self.assertEqual(getattr(entry, name), getattr(expected, name),
+                    name)
+
+
+class TranscriptWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = _CueListReader(random_cues(random.Random(5), 50))
+        self.writer = format.SubTranscriptWriter(self.reader)
+        self.expected = self.writer.content.encode('utf-8')
+
+    def test_write_to(self):
+        class ListFile(list):
+            write = list.append
+
+        output = ListFile()
+        self.writer.write_to(output)
+
+        # One encoded write per cue
+        self.assertEqual(len(output), len(self.reader.cues))
+        self.assertTrue(all(isinstance(data, str) for data in output))
+        self.assertEqual(''.join(output), self.expected)
+
+    def test_get_file_reads_in_pieces(self):
+        for size in (1, 7, 1000, len(self.expected) + 1):
+            stream = self.writer.get_file()
+            pieces = []
+            while True:
+                piece = stream.read(size)
+                if not piece:
+                    break
+                self.assertTrue(len(piece) <= size)
+                pieces.append(piece)
+            self.assertEqual(''.join(pieces), self.expected)
+
+        stream = self.writer.get_file()
+        self.assertEqual(stream.read(10) + stream.read(), self.expected)
+
+    def test_stream_pulls_chunks_as_read(self):
+        pulled = []
+
+        def chunks():
+            for chunk in (u'caza ', u'con ', u'arco'):
+                pulled.append(chunk)
+                yield chunk
+
+        stream = format.TranscriptStream(chunks())
+        self.assertEqual(stream.read(3), 'caz')
+        self.assertEqual(pulled, [u'caza '])
+        self.assertEqual(stream.read(), 'a con arco')
+
+        stream.close()
+        self.assertEqual(stream.read(), '')
+
+
+class CodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = _CueListReader(random_cues(random.Random(4), 50))
+        self.sub_content = format.SubTranscriptWriter(self.reader).content
+
+    def test_round_trips(self):
+        for name in ('sub', 'sbv', 'srt', 'vtt', 'amara', 'po', 'gettext'):
+            content = format.convert(self.sub_content, 'sub', name).content
+            self.assertEqual(format.read_transcript(content, name).list_entries(),
+                self.reader.list_entries(), name)
+
+    def test_srt(self):
+        reader = format.SrtTranscriptReader(u'\ufeff' + read_example(
+            'testVideo1-fr.srt'))
+        self.assertEqual(reader.list_entries()[0], ('0:00:00.504,0:00:05.270',
+            u"Bonour. Je m'appelle Matt Faus et ceci est une vidéo test"))
+
+        writer = format.SrtTranscriptWriter(reader)
+        self.assertEqual(writer.content.rstrip(),
+            read_example('testVideo1-fr.srt').rstrip())
+        self.assertEqual(writer._format_entry(format.Cue(1, 3723004, u'hi'), 7),
+            u'7\n00:00:00,001 --> 01:02:03,004\nhi\n\n')
+
+    def test_vtt_skips_headers_notes_and_identifiers(self):
+        content = (u'WEBVTT - a title\n\n'
+            u'NOTE a comment\n\n'
+            u'intro\n'
+            u'00:01.000 --> 00:02.500 align:start\n'
+            u'hello\nworld\n\n'
+            u'1:00:00.000 --> 1:00:01.000\n'
+            u'bye\n')
+        reader = format.VttTranscriptReader(content)
+        self.assertEqual(as_tuples(reader.cues), [
+            (1000, 2500, u'hello\nworld'),
+            (3600000, 3601000, u'bye'),
+        ])
+        self.assertTrue(format.VttTranscriptWriter(reader).content.startswith(
+            u'WEBVTT\n\n00:00:01.000 --> 00:00:02.500\nhello\nworld\n\n'))
+
+    def test_amara(self):
+        content = (u'{"sub_format": "json", "subtitles": ['
+            u'{"start": 1000, "end": 2000, "text": "synced"}, '
+            u'{"start": -1, "end": -1, "text": "unsynced"}, '
+            u'{"start": null, "end": 3000, "text": "unsynced"}]}')
+        reader = format.AmaraJsonTranscriptReader(content)
+        self.assertEqual(as_tuples(reader.cues), [(1000, 2000, u'synced')])
+
+        srt_content = format.SrtTranscriptWriter(reader).content
+        reader = format.AmaraJsonTranscriptReader(
+            json.dumps({'sub_format': 'srt', 'subtitles': srt_content}))
+        self.assertEqual(as_tuples(reader.cues), [(1000, 2000, u'synced')])
+
+        self.assertEqual(format.AmaraJsonTranscriptWriter(
+            _CueListReader([])).content, '[]\n')
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = _CueListReader(random_cues(random.Random(6), 50))
+        self.fingerprint = self.reader.fingerprint()
+
+    def test_same_in_every_format(self):
+        for name in ('sub', 'srt', 'vtt', 'amara', 'po', 'gettext'):
+            content = format.convert(
+                format.SubTranscriptWriter(self.reader).content, 'sub', name)
+            reader = format.read_transcript(content.content, name)
+            self.assertEqual(reader.fingerprint(), self.fingerprint, name)
+
+        # A downloaded .sub is a utf-8 str
+        content = format.SubTranscriptWriter(self.reader).content
+        self.assertEqual(format.SubTranscriptReader(
+            content.encode('utf-8')).fingerprint(), self.fingerprint)
+
+    def test_only_words_and_timings_count(self):
+        rewrapped = _CueListReader([format.Cue(cue.start, cue.end,
+            u'  ' + u' \n'.join(cue.text.split()) + u'\t')
+            for cue in self.reader.cues])
+        self.assertEqual(rewrapped.fingerprint(), self.fingerprint)
+
+        cues = list(self.reader.cues)
+        cues[10] = format.Cue(cues[10].start, cues[10].end, u'changed')
+        self.assertNotEqual(_CueListReader(cues).fingerprint(),
+            self.fingerprint)
+
+        cues = list(self.reader.cues)
+        cues[-1] = format.Cue(cues[-1].start, cues[-1].end + 1, cues[-1].text)
+        self.assertNotEqual(_CueListReader(cues).fingerprint(),
+            self.fingerprint)
+
+
+class DiffTranscriptsTest(unittest.TestCase):
+
+    def test_diff(self):
+        old = _CueListReader([
+            format.Cue(0, 1000, u'same'),
+            format.Cue(1000, 2000, u'removed'),
+            format.Cue(2000, 3000, u'old text'),
+        ])
+        new = _CueListReader([
+            format.Cue(0, 1000, u'same'),
+            format.Cue(1000, 1500, u'added'),
+            format.Cue(2000, 3000, u'new text'),
+            format.Cue(4000, 5000, u'added at the end'),
+        ])
+
+        diff = format.diff_transcripts(old, new)
+        self.assertFalse(diff.is_noop)
+        self.assertEqual(as_tuples(diff.added),
+            [(1000, 1500, u'added'), (4000, 5000, u'added at the end')])
+        self.assertEqual(as_tuples(diff.removed), [(1000, 2000, u'removed')])
+        self.assertEqual([(old_cue.text, new_cue.text)
+            for old_cue, new_cue in diff.changed], [(u'old text', u'new text')])
+        self.assertEqual(diff.unchanged_count, 1)
+
+    def test_downloaded_track_matches_translation(self):
+        # A downloaded .sub is a utf-8 str, a translation is unicode
+        new = _CueListReader(random_cues(random.Random(3), 100))
+        downloaded = format.SubTranscriptWriter(new).content.encode('utf-8')
+
+        diff = format.diff_transcripts(format.SubTranscriptReader(downloaded),
+            new)
+        self.assertTrue(diff.is_noop)
+        self.assertEqual(diff.unchanged_count, len(new.cues))
+
+    def test_unreadable_track_is_an_error(self):
+        # The sync rewrites tracks it cannot read
+        self.assertRaises(ValueError, format.SubTranscriptReader,
+            '<html>Service Unavailable</html>')
+
+
+class MappedSubTranscriptReaderTest(unittest.TestCase):
+
+    def assert_matches_sub_reader(self, content):
+        with tempfile.NamedTemporaryFile(suffix='.sub', delete=False) as sub_file:
+            sub_file.write(content.encode('utf-8'))
+
+        try:
+            mapped = format.MappedSubTranscriptReader(sub_file.name)
+            try:
+                self.assertEqual(as_tuples(mapped.iter_cues()),
+                    as_tuples(format.SubTranscriptReader(content).cues))
+            finally:
+                mapped.close()
+        finally:
+            os.remove(sub_file.name)
+
+    def test_example(self):
+        self.assert_matches_sub_reader(read_example('testVideo1.sub'))
+
+    def test_timing_without_text(self):
+        self.assert_matches_sub_reader(u'0:00:01.000,0:00:02.000\n')
+        self.assert_matches_sub_reader(u'0:00:01.000,0:00:02.000\n\n')
+        self.assert_matches_sub_reader(
+            u'0:00:01.000,0:00:02.000\nhi\n\n0:00:03.000,0:00:04.000')
+
+    def test_read_only(self):
+        mapped = format.MappedSubTranscriptReader(
+            os.path.join(EXAMPLES_DIR, 'testVideo1.sub'))
+        try:
+            self.assertRaises(TypeError, mapped.set_timings,
+                mapped.get_timings())
+        finally:
+            mapped.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+"""
+Converts every transcript in a directory or .zip file into another format,
+for example a CrowdIn translations export or an Amara export directory.
+
+Files are converted in a pool of worker processes.  Members of a source .zip
+are read straight out of the archive by each worker, nothing is extracted to
+disk.  Results are written into a destination directory, or into a .zip file
+when the destination ends with .zip.
+
+Example:
+    tools/batch_transcode.py -t srt all.zip srt_export.zip
+"""
+import cStringIO
+import multiprocessing
+import optparse
+import os
+import sys
+import time
+import zipfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import format
+
+# Opened once per worker process by _init_worker()
+_source_zip = None
+
+
+def _init_worker(source_path):
+    global _source_zip
+    if zipfile.is_zipfile(source_path):
+        _source_zip = zipfile.ZipFile(source_path)
+
+
+def _read_source(source_path, name):
+    if _source_zip:
+        return _source_zip.read(name)
+
+    with open(os.path.join(source_path, name), 'rb') as source_file:
+        return source_file.read()
+
+
+def list_transcripts(source_path, from_format=None):
+    """Returns the relative names of all files in source_path, a directory or
+    a .zip file, which can be converted.
+    """
+    if zipfile.is_zipfile(source_path):
+        names = [n for n in zipfile.ZipFile(source_path).namelist()
+            if not n.endswith('/')]
+    else:
+        names = []
+        for dir_path, dir_names, file_names in os.walk(source_path):
+            for file_name in file_names:
+                full_path = os.path.join(dir_path, file_name)
+                names.append(os.path.relpath(full_path, source_path))
+
+    if from_format:
+        return sorted(names)
+    return sorted(n for n in names if format.guess_format(n))
+
+
+def get_dest_name(name, to_format):
+    return os.path.splitext(name)[0] + format.FORMAT_EXTENSIONS[to_format]
+
+
+def transcode_file(args):
+    """Converts a single file.  Runs in a worker process.
+
+    Arguments:
+        args - a tuple of (source_path, name, from_format, to_format,
+            dest_dir), where from_format may be None to guess it from the
+            name, and dest_dir is None to return the output instead of
+            writing it to disk.
+
+    Returns:
+        A dict with the name, dest_name, output (if dest_dir is None),
+        bytes_in, bytes_out, cues, seconds and error.
+    """
+    source_path, name, from_format, to_format, dest_dir = args
+    result = {
+        'name': name,
+        'dest_name': None,
+        'output': None,
+        'bytes_in': 0,
+        'bytes_out': 0,
+        'cues': 0,
+        'seconds': 0,
+        'error': None,
+    }
+
+    start = time.time()
+    try:
+        result['dest_name'] = get_dest_name(name, to_format)
+        content = _read_source(source_path, name)
+        result['bytes_in'] = len(content)
+
+        writer = format.convert(content.decode('utf-8-sig'),
+            from_format or format.guess_format(name), to_format)
+        result['cues'] = len(writer.reader.cues)
+
+        if dest_dir is None:
+            output = cStringIO.StringIO()
+            writer.write_to(output)
+            result['output'] = output.getvalue()
+            result['bytes_out'] = len(result['output'])
+        else:
+            dest_path = os.path.join(dest_dir, result['dest_name'])
+            if not os.path.isdir(os.path.dirname(dest_path)):
+                try:
+                    os.makedirs(os.path.dirname(dest_path))
+                except OSError:
+                    # Another worker created it first
+                    pass
+
+            with open(dest_path, 'wb') as dest_file:
+                writer.write_to(dest_file)
+                result['bytes_out'] = dest_file.tell()
+    except Exception, e:
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+
+    result['seconds'] = time.time() - start
+    return result
+
+
+def batch_transcode(source_path, dest_path, to_format, from_format=None,
+    processes=None, store=False, verbose=True):
+    """Converts every transcript in source_path into dest_path.
+
+    Arguments:
+        source_path - a directory or .zip file of transcripts
+        dest_path - a directory, or a .zip file if it ends with .zip
+        to_format - a format name registered in format.CODECS
+        from_format - if None, guessed from each file's extension
+        processes - the size of the worker pool, defaults to the CPU count
+        store - write an uncompressed .zip, which keeps this process from
+            becoming the bottleneck when there are many cores
+        verbose - print throughput for each file
+
+    Returns:
+        A list of (name, error) for the files which could not be converted.
+    """
+    names = list_transcripts(source_path, from_format)
+
+    to_zip = dest_path.lower().endswith('.zip')
+    if to_zip:
+        dest_zip = zipfile.ZipFile(dest_path, 'w',
+            zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED)
+        dest_dir = None
+    else:
+        dest_zip = None
+        dest_dir = dest_path
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+
+    tasks = [(source_path, n, from_format, to_format, dest_dir) for n in names]
+
+    pool = multiprocessing.Pool(processes, _init_worker, (source_path,))
+    errors = []
+    total_bytes = 0
+    total_cues = 0
+    start = time.time()
+
+    try:
+        for result in pool.imap_unordered(transcode_file, tasks, chunksize=8):
+            if result['error']:
+                print 'ERROR %s - %s' % (result['name'], result['error'])
+                errors.append((result['name'], result['error']))
+                continue
+
+            if dest_zip:
+                dest_zip.writestr(result['dest_name'], result['output'])
+
+            total_bytes += result['bytes_in']
+            total_cues += result['cues']
+
+            if verbose:
+                seconds = max(result['seconds'], 1e-6)
+                print '%s -> %s: %i cues, %.0f cues/sec, %.2f MB/sec' % (
+                    result['name'], result['dest_name'], result['cues'],
+                    result['cues'] / seconds,
+                    result['bytes_in'] / seconds / 2 ** 20)
+    finally:
+        pool.close()
+        pool.join()
+        if dest_zip:
+            dest_zip.close()
+
+    seconds = max(time.time() - start, 1e-6)
+    print 'Converted %i of %i files in %.1fs: %.0f cues/sec, %.2f MB/sec' % (
+        len(names) - len(errors), len(names), seconds,
+        total_cues / seconds, total_bytes / seconds / 2 ** 20)
+
+    return errors
+
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options] SOURCE_DIR_OR_ZIP DEST_DIR_OR_ZIP')
+
+    parser.add_option('-t', '--to-format',
+        action="store", dest="to_format",
+        help="REQUIRED: The format to write, one of %s" % (
+            ', '.join(sorted(format.CODECS))),
+        default="")
+
+    parser.add_option('-f', '--from-format',
+        action="store", dest="from_format",
+        help="The format of every source file, guessed from the file "
+            "extension when not provided",
+        default=None)
+
+    parser.add_option('-p', '--processes',
+        action="store", dest="processes", type="int",
+        help="Number of worker processes, defaults to the number of CPUs",
+        default=None)
+
+    parser.add_option('-s', '--store',
+        action="store_true", dest="store",
+        help="Do not compress the destination .zip file",
+        default=False)
+
+    parser.add_option('-q', '--quiet',
+        action="store_false", dest="verbose",
+        help="Only print errors and the final summary",
+        default=True)
+
+    options, args = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error('A source and a destination must be provided.')
+
+    if options.to_format not in format.CODECS:
+        parser.error('-t (--to-format) must be one of %s' % (
+            ', '.join(sorted(format.CODECS))))
+
+    if options.from_format and options.from_format not in format.CODECS:
+        parser.error('-f (--from-format) must be one of %s' % (
+            ', '.join(sorted(format.CODECS))))
+
+    errors = batch_transcode(args[0], args[1], options.to_format,
+        options.from_format, options.processes, options.store,
+        options.verbose)
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
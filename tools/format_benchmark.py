@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""
+Benchmarks the transcript readers and writers in format.py on a synthetic
+corpus, and compares the results against a saved baseline.
+
+The corpus is generated deterministically from a seed, so two runs with the
+same options parse exactly the same transcripts.  Each benchmark runs in its
+own child process so its peak memory can be measured.
+
+Example:
+    tools/format_benchmark.py -n 20000 -o before.json
+    ... make changes ...
+    tools/format_benchmark.py -n 20000 -o after.json -b before.json
+"""
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import re
+import resource
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import format
+
+# Code point ranges used to build words in each script
+SCRIPTS = {
+    'latin': [(0x61, 0x7a), (0xe0, 0xff)],
+    'cyrillic': [(0x430, 0x44f)],
+    'greek': [(0x3b1, 0x3c9)],
+    'arabic': [(0x627, 0x64a)],
+    'devanagari': [(0x905, 0x939)],
+    'cjk': [(0x4e00, 0x9fa5)],
+    'hangul': [(0xac00, 0xd7a3)],
+}
+
+# Scripts which are not written with spaces between words
+UNSPACED_SCRIPTS = ('cjk',)
+
+
+def _random_word(rand, script):
+    low, high = rand.choice(SCRIPTS[script])
+    length = rand.randint(1, 4) if script in UNSPACED_SCRIPTS else rand.randint(2, 9)
+    return u''.join(unichr(rand.randint(low, high)) for _ in xrange(length))
+
+
+def _random_line(rand, script, line_length):
+    separator = u'' if script in UNSPACED_SCRIPTS else u' '
+    words = []
+    length = 0
+    while length < line_length:
+        word = _random_word(rand, script)
+        words.append(word)
+        length += len(word) + len(separator)
+    return separator.join(words)[:line_length]
+
+
+def generate_cues(cue_count, line_length=42, scripts=('latin',), seed=0):
+    """Returns a list of cue_count format.Cue objects in time order.
+
+    Arguments:
+        cue_count - how many cues to generate
+        line_length - the number of characters in each line of text
+        scripts - the script of each cue is picked from these, see SCRIPTS
+        seed - the same seed always generates the same cues
+    """
+    rand = random.Random(seed)
+    cues = []
+    start = 0
+
+    for _ in xrange(cue_count):
+        start += rand.randint(0, 500)
+        end = start + rand.randint(500, 6000)
+        script = rand.choice(scripts)
+        lines = [_random_line(rand, script, line_length)
+            for _ in xrange(rand.randint(1, 2))]
+        cues.append(format.Cue(start, end, u'\n'.join(lines)))
+        start = end
+
+    return cues
+
+
+class _CueListReader(format.TranscriptReader):
+    """Feeds generated cues to the writers."""
+
+    def __init__(self, cues):
+        self._set_cues(cues)
+
+
+class _NullFile(object):
+    def write(self, data):
+        pass
+
+
+def generate_corpus(cue_count, line_length=42, scripts=('latin',), seed=0):
+    """Returns a dict with the generated 'reader', and its content as
+    unicode strings: 'sub', 'po' from PotTranscriptWriter and 'gettext'
+    from PoCatalogWriter.
+    """
+    reader = _CueListReader(generate_cues(cue_count, line_length, scripts, seed))
+    return {
+        'reader': reader,
+        'sub': format.SubTranscriptWriter(reader).content,
+        'po': format.PotTranscriptWriter(reader).content,
+        'gettext': format.PoCatalogWriter(reader).content,
+    }
+
+
+# The timestamp regex and .po loop of PotTranscriptReader before it was
+# optimized, frozen here as the reference every .po reader must beat
+_BASELINE_REGEX_TIMESTAMP = re.compile(
+    '((?P<start_time>\d:\d\d:\d\d(\.\d\d\d)?),(?P<end_time>\d:\d\d:\d\d(\.\d\d\d)?))')
+
+
+def baseline_pot_reader(content):
+    """Returns {timestamp: text} for .po content, exactly as the original
+    PotTranscriptReader._build_entries() did.
+    """
+    entries = {}
+
+    cur_timestamp = None
+    cur_id = ""
+    cur_string = ""
+
+    for line in content.splitlines():
+        if not line and cur_timestamp and cur_string:
+            entries[cur_timestamp] = cur_string[:-1]
+            cur_timestamp = None
+            cur_id = ""
+            cur_string = ""
+            continue
+
+        if not cur_timestamp:
+            timestamp_match = _BASELINE_REGEX_TIMESTAMP.search(line)
+            if timestamp_match:
+                cur_timestamp = timestamp_match.groups()[0]
+        else:
+            if not cur_id:
+                if line.startswith('msgid "'):
+                    cur_id += line[len('msgid "'):-1] + '\n'
+            elif line.startswith('"'):
+                cur_id += line[1:-1] + '\n'
+
+            if not cur_string:
+                if line.startswith('msgstr "'):
+                    cur_string += line[len('msgstr "'):-1] + '\n'
+            elif line.startswith('"'):
+                cur_string += line[1:-1] + '\n'
+
+    if cur_timestamp and cur_string:
+        entries[cur_timestamp] = cur_string[:-1]
+
+    return entries
+
+
+# Maps a benchmark name to (corpus key of its input, function to time)
+BENCHMARKS = {
+    'baseline_pot_reader': ('po', baseline_pot_reader),
+    'baseline_pot_reader_gettext': ('gettext', baseline_pot_reader),
+    'sub_reader': ('sub', format.SubTranscriptReader),
+    'pot_reader': ('po', format.PotTranscriptReader),
+    'pot_reader_by_line': ('po',
+        lambda content: format.PotTranscriptReader(content, use_regex=False)),
+    'gettext_reader': ('gettext', format.GettextTranscriptReader),
+    'gettext_reader_legacy_po': ('po', format.GettextTranscriptReader),
+    'transcode_po_to_sub': ('gettext',
+        lambda content: format.transcode_po_to_sub(content, fingerprint=True)),
+    'transcode_po_to_sub_legacy_po': ('po',
+        lambda content: format.transcode_po_to_sub(content, fingerprint=True)),
+    'sub_writer': ('reader',
+        lambda reader: format.SubTranscriptWriter(reader).write_to(_NullFile())),
+    'pot_writer': ('reader',
+        lambda reader: format.PotTranscriptWriter(reader).write_to(_NullFile())),
+    'gettext_writer': ('reader',
+        lambda reader: format.PoCatalogWriter(reader).write_to(_NullFile())),
+}
+
+
+# The original loop run on each input, which the readers of that input are
+# compared against.  It only reads the timings and msgstrs of a catalog.
+BASELINES = {
+    'po': 'baseline_pot_reader',
+    'gettext': 'baseline_pot_reader_gettext',
+}
+
+
+def _run_benchmark(name, corpus, repeat, results_queue):
+    """Times one benchmark.  Runs in a child process."""
+    input_key, function = BENCHMARKS[name]
+    benchmark_input = corpus[input_key]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        function(benchmark_input)
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    results_queue.put({
+        'seconds': best,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_memory_kb': rss_after - rss_before,
+    })
+
+
+def run_benchmarks(names, corpus, repeat=3):
+    """Returns a dict like {name: {cues_per_sec, mb_per_sec, seconds,
+    peak_memory_kb}}.
+    """
+    cue_count = len(corpus['reader'].cues)
+    # Throughput is measured against the size of the .sub file, so reader
+    # and writer numbers can be compared
+    megabytes = len(corpus['sub'].encode('utf-8')) / float(2 ** 20)
+
+    results = {}
+    for name in names:
+        results_queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_benchmark,
+            args=(name, corpus, repeat, results_queue))
+        process.start()
+        result = results_queue.get()
+        process.join()
+
+        seconds = max(result['seconds'], 1e-9)
+        result['cues_per_sec'] = cue_count / seconds
+        result['mb_per_sec'] = megabytes / seconds
+        results[name] = result
+
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    """Prints each benchmark's change against the baseline.
+
+    Returns:
+        The names of benchmarks whose cues/sec dropped by more than threshold,
+        a fraction like 0.1.
+    """
+    regressions = []
+
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+
+        old = baseline[name]['cues_per_sec']
+        new = results[name]['cues_per_sec']
+        change = (new - old) / old if old else 0.0
+
+        print '%-26s %12.0f -> %12.0f cues/sec (%+.1f%%)' % (
+            name, old, new, change * 100)
+
+        if change < -threshold:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = optparse.OptionParser()
+
+    parser.add_option('-n', '--cue-count',
+        action="store", dest="cue_count", type="int",
+        help="Number of cues in the generated transcript",
+        default=10000)
+
+    parser.add_option('-l', '--line-length',
+        action="store", dest="line_length", type="int",
+        help="Number of characters in each line of a cue",
+        default=42)
+
+    parser.add_option('-s', '--scripts',
+        action="store", dest="scripts",
+        help="A comma-delimited list of scripts to mix, from %s" % (
+            ', '.join(sorted(SCRIPTS))),
+        default="latin")
+
+    parser.add_option('--seed',
+        action="store", dest="seed", type="int",
+        help="Seed for the corpus generator",
+        default=0)
+
+    parser.add_option('-r', '--repeat',
+        action="store", dest="repeat", type="int",
+        help="Runs of each benchmark, the fastest is recorded",
+        default=3)
+
+    parser.add_option('-k', '--benchmarks',
+        action="store", dest="benchmarks",
+        help="A comma-delimited list of benchmarks to run, from %s" % (
+            ', '.join(sorted(BENCHMARKS))),
+        default=','.join(sorted(BENCHMARKS)))
+
+    parser.add_option('-o', '--output',
+        action="store", dest="output",
+        help="Write the results to this JSON file",
+        default="")
+
+    parser.add_option('-b', '--baseline',
+        action="store", dest="baseline",
+        help="Compare against the results in this JSON file",
+        default="")
+
+    parser.add_option('-t', '--threshold',
+        action="store", dest="threshold", type="float",
+        help="Fail if cues/sec drops by more than this fraction of the baseline",
+        default=0.1)
+
+    options, args = parser.parse_args()
+
+    scripts = options.scripts.split(',')
+    for script in scripts:
+        if script not in SCRIPTS:
+            parser.error('Unknown script: %s' % script)
+
+    names = options.benchmarks.split(',')
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark: %s' % name)
+
+    config = {
+        'cue_count': options.cue_count,
+        'line_length': options.line_length,
+        'scripts': scripts,
+        'seed': options.seed,
+        'repeat': options.repeat,
+    }
+
+    corpus = generate_corpus(options.cue_count, options.line_length,
+        scripts, options.seed)
+    results = run_benchmarks(names, corpus, options.repeat)
+
+    for name in sorted(results):
+        result = results[name]
+        line = '%-26s %12.0f cues/sec %8.2f MB/sec %10i KB peak' % (
+            name, result['cues_per_sec'], result['mb_per_sec'],
+            result['peak_memory_kb'])
+        baseline_result = results.get(BASELINES.get(BENCHMARKS[name][0]))
+        if baseline_result:
+            # Readers should be at least 1.00x the original loop on the
+            # same input
+            line += ' %6.2fx baseline' % (
+                result['cues_per_sec'] / baseline_result['cues_per_sec'])
+        print line
+
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump({'config': config, 'results': results}, output_file,
+                indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        if baseline.get('config') != config:
+            print 'WARNING: baseline was run with a different configuration'
+
+        regressions = compare_results(results, baseline['results'],
+            options.threshold)
+        if regressions:
+            print 'Regressions: %s' % ', '.join(regressions)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -47,13 +47,25 @@ class YouTubeCaptionEditor(object):
             return False
         return True
 
+    @staticmethod
+    def _encode_track_content(track_content):
+        """Accepts a unicode string or a file-like object, such as the one
+        returned by TranscriptWriter.get_file(), which yields utf-8 bytes.
+        """
+        if hasattr(track_content, 'read'):
+            return track_content.read()
+        return track_content.encode('utf-8')
+
     def add_track(self, video_id, title, language, track_content):
         """Adds a caption track.
 
         If a track with the same title already exists, this will silently fail.
+
+        Arguments:
+            track_content - a unicode string or a file-like object
         """
         # TODO(mattfaus): Take google_developer_key as a constructor arg?
-        track_content = track_content.encode('utf-8')
+        track_content = self._encode_track_content(track_content)
         response = self.youtube_client.create_track(video_id, title, language,
             track_content, client_id=GDATA_API_CLIENT_ID,
             developer_key=secrets.google_developer_key, fmt='sub')
@@ -62,9 +74,13 @@ class YouTubeCaptionEditor(object):
         return response
 
     def update_track(self, video_id, track_id, track_content):
-        """Adds a caption track."""
+        """Updates a caption track.
+
+        Arguments:
+            track_content - a unicode string or a file-like object
+        """
         # TODO(mattfaus): Take google_developer_key as a constructor arg?
-        track_content = track_content.encode('utf-8')
+        track_content = self._encode_track_content(track_content)
         response = self.youtube_client.update_track(video_id, track_id,
             track_content, client_id=GDATA_API_CLIENT_ID,
             developer_key=secrets.google_developer_key, fmt='sub')